@@ -3,7 +3,6 @@ from __future__ import annotations
 from collections.abc import Iterable
 from collections.abc import Mapping
 from typing import Generic
-from typing import Protocol
 from typing import TypeVar
 
 TKey = TypeVar('TKey', contravariant=True)
@@ -25,21 +24,3 @@ class FDict(Generic[TKey, TValue]):
 
     def values(self) -> Iterable[TValue]:
         return self._dct.values()
-
-
-class Indexable(Generic[TKey, TValue], Protocol):
-    def __getitem__(self, key: TKey) -> TValue: ...
-
-
-class FChainMap(Generic[TKey, TValue]):
-    def __init__(self, *mappings: Indexable[TKey, TValue]) -> None:
-        self._mappings = mappings
-
-    def __getitem__(self, key: TKey) -> TValue:
-        for mapping in reversed(self._mappings):
-            try:
-                return mapping[key]
-            except KeyError:
-                pass
-        else:
-            raise KeyError(key)
@@ -304,9 +304,17 @@ class File:
 
         self.buf = Buf(lines, self.buf.tab_size)
 
+        messages = []
+        if any(len(line) > self.highlight_limit for line in lines):
+            messages.append(
+                f'lines longer than {self.highlight_limit} characters are '
+                f'not highlighted',
+            )
         if mixed:
-            status.update(f'mixed newlines will be converted to {self.nl!r}')
+            messages.append(f'mixed newlines will be converted to {self.nl!r}')
             self.modified = True
+        if messages:
+            status.update('; '.join(messages))
 
         self._initialize_highlighters()
 
@@ -316,7 +324,19 @@ class File:
     def root_scope(self) -> str:
         return self._file_syntax.root_scope
 
+    @property
+    def highlight_pending(self) -> bool:
+        return self._file_syntax.pending
+
+    @property
+    def highlight_limit(self) -> int:
+        return self._file_syntax.highlight_limit
+
+    def set_highlight_limit(self, limit: int) -> None:
+        self._file_syntax.set_highlight_limit(limit)
+
     def _initialize_highlighters(self) -> None:
+        highlight_limit = self._file_syntax.highlight_limit
         if self.filename is not None:
             self._file_syntax = self._syntax.file_highlighter(
                 self.filename,
@@ -324,7 +344,10 @@ class File:
             )
         else:
             self._file_syntax = self._syntax.blank_file_highlighter()
+        self._file_syntax.highlight_limit = highlight_limit
+        self._register_highlighters()
 
+    def _register_highlighters(self) -> None:
         # hack due to https://github.com/python/mypy/issues/12360
         file_hls: tuple[FileHL, ...] = (
             self._file_syntax,
@@ -340,15 +363,22 @@ class File:
             file_hl.register_callbacks(self.buf)
 
     def reload_theme(self, syntax: Syntax) -> None:
+        grammars_changed = syntax.grammars is not self._syntax.grammars
         self._syntax = syntax
         self.lint_errors = self.lint_errors.clone(
             syntax.color_manager,
             syntax.theme,
         )
         self._trailing_whitespace = TrailingWhitespace(syntax.color_manager)
-        # only re-initialize the highlighters if we've loaded once
-        if self._file_hls:
+        # only re-register the highlighters if we've loaded once
+        if not self._file_hls:
+            return
+        elif grammars_changed:
             self._initialize_highlighters()
+        else:
+            # the tokenized lines don't depend on the theme, keep them
+            self._file_syntax.set_theme(syntax.theme, syntax.color_manager)
+            self._register_highlighters()
 
     def __repr__(self) -> str:
         return f'<{type(self).__name__} {self.filename!r}>'
@@ -1019,53 +1049,87 @@ class File:
     ) -> None:
         stdscr.move(*self.buf.cursor_position(dim))
 
-    def draw(self, stdscr: curses._CursesWindow, dim: Dim) -> None:
-        to_display = min(self.buf.displayable_count, dim.height)
+    def _draw_line(
+            self,
+            stdscr: curses._CursesWindow,
+            dim: Dim,
+            i: int,
+    ) -> None:
+        draw_y = i + dim.y
+        l_y = self.buf.file_y + i
+        stdscr.insstr(draw_y, 0, self.buf.rendered_line(l_y, dim))
 
+        l_x = self.buf.line_x(dim) if l_y == self.buf.y else 0
+        l_x_max = l_x + dim.width
         for file_hl in self._file_hls:
-            file_hl.highlight_until(self.buf, self.buf.file_y + to_display)
+            for region in file_hl.regions[l_y]:
+                l_positions = self.buf.line_positions(l_y)
+                r_x = l_positions[region.x]
+                # the selection highlight intentionally extends one past
+                # the end of the line, which won't have a position
+                if region.end == len(l_positions):
+                    r_end = l_positions[-1] + 1
+                else:
+                    r_end = l_positions[region.end]
+
+                if r_x >= l_x_max:
+                    break
+                elif r_end <= l_x:
+                    continue
 
-        for i in range(to_display):
-            draw_y = i + dim.y
-            l_y = self.buf.file_y + i
-            stdscr.insstr(draw_y, 0, self.buf.rendered_line(l_y, dim))
-
-            l_x = self.buf.line_x(dim) if l_y == self.buf.y else 0
-            l_x_max = l_x + dim.width
-            for file_hl in self._file_hls:
-                for region in file_hl.regions[l_y]:
-                    l_positions = self.buf.line_positions(l_y)
-                    r_x = l_positions[region.x]
-                    # the selection highlight intentionally extends one past
-                    # the end of the line, which won't have a position
-                    if region.end == len(l_positions):
-                        r_end = l_positions[-1] + 1
+                if l_x and r_x <= l_x:
+                    if file_hl.include_edge:
+                        h_s_x = 0
                     else:
-                        r_end = l_positions[region.end]
-
-                    if r_x >= l_x_max:
-                        break
-                    elif r_end <= l_x:
-                        continue
-
-                    if l_x and r_x <= l_x:
-                        if file_hl.include_edge:
-                            h_s_x = 0
-                        else:
-                            h_s_x = 1
-                    else:
-                        h_s_x = r_x - l_x
+                        h_s_x = 1
+                else:
+                    h_s_x = r_x - l_x
 
-                    if r_end >= l_x_max and l_x_max < l_positions[-1]:
-                        if file_hl.include_edge:
-                            h_e_x = dim.width
-                        else:
-                            h_e_x = dim.width - 1
+                if r_end >= l_x_max and l_x_max < l_positions[-1]:
+                    if file_hl.include_edge:
+                        h_e_x = dim.width
                     else:
-                        h_e_x = r_end - l_x
+                        h_e_x = dim.width - 1
+                else:
+                    h_e_x = r_end - l_x
+
+                stdscr.chgat(draw_y, h_s_x, h_e_x - h_s_x, region.attr)
 
-                    stdscr.chgat(draw_y, h_s_x, h_e_x - h_s_x, region.attr)
+    def draw(self, stdscr: curses._CursesWindow, dim: Dim) -> None:
+        if self._file_syntax.failed:
+            # the tokenizer process died: start over highlighting in process
+            self._initialize_highlighters()
+
+        to_display = min(self.buf.displayable_count, dim.height)
+
+        for file_hl in self._file_hls:
+            file_hl.highlight_until(self.buf, self.buf.file_y + to_display)
+
+        for i in range(to_display):
+            self._draw_line(stdscr, dim, i)
 
         for i in range(to_display, dim.height):
             stdscr.move(i + dim.y, 0)
             stdscr.clrtoeol()
+
+    def draw_pending_highlight(
+            self,
+            stdscr: curses._CursesWindow,
+            dim: Dim,
+    ) -> None:
+        # another frame's worth of highlighting, only the lines it finished
+        # are redrawn rather than the whole screen
+        if self._file_syntax.failed:
+            self.draw(stdscr, dim)
+            return
+
+        to_display = min(self.buf.displayable_count, dim.height)
+        start, end = self.buf.file_y, self.buf.file_y + to_display
+        regions = self._file_syntax.regions
+        before = regions[start:end]
+
+        self._file_syntax.highlight_until(self.buf, end)
+
+        for i, prev in enumerate(before):
+            if regions[start + i] is not prev:
+                self._draw_line(stdscr, dim, i)
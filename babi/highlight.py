@@ -1,10 +1,18 @@
 from __future__ import annotations
 
+import bisect
+import contextlib
 import functools
+import importlib.metadata
 import json
 import os.path
-from re import Match
+import pickle
+import tempfile
+import weakref
+from collections.abc import Generator
+from collections.abc import Iterable
 from typing import Any
+from typing import Generic
 from typing import NamedTuple
 from typing import Protocol
 from typing import TypeVar
@@ -12,13 +20,14 @@ from typing import TypeVar
 from identify.identify import tags_from_filename
 from identify.identify import tags_from_path
 
-from babi.fdict import FChainMap
 from babi.reg import _Reg
 from babi.reg import _RegSet
+from babi.reg import clear_searches
 from babi.reg import ERR_REG
-from babi.reg import expand_escaped
+from babi.reg import make_backref_reg
 from babi.reg import make_reg
 from babi.reg import make_regset
+from babi.reg import Match
 
 T = TypeVar('T')
 Scope = tuple[str, ...]
@@ -53,21 +62,16 @@ class Rule(NamedTuple):
     while_captures: Captures
     include: str | None
     patterns: tuple[Rule, ...]
-    repository: FChainMap[str, Rule]
+    repository: _Repository
 
     @classmethod
     def make(
             cls,
             dct: dict[str, Any],
-            parent_repository: FChainMap[str, Rule],
+            parent_repository: _Repository,
     ) -> Rule:
         if 'repository' in dct:
-            # this looks odd, but it's so we can have a self-referential
-            # immutable-after-construction chain map
-            repository_dct: dict[str, Rule] = {}
-            repository = FChainMap(parent_repository, repository_dct)
-            for k, sub_dct in dct['repository'].items():
-                repository_dct[k] = Rule.make(sub_dct, repository)
+            repository = _Repository(dct['repository'], parent_repository)
         else:
             repository = parent_repository
 
@@ -147,24 +151,47 @@ class Rule(NamedTuple):
         )
 
 
+class _Repository:
+    """repository rules are made the first time they are looked up
+
+    most of a large grammar is never reached by any one file.  each rule is
+    only made once so they can still be cached by identity
+    """
+
+    def __init__(
+            self,
+            raw: dict[str, Any],
+            parent: _Repository | None,
+    ) -> None:
+        self._raw = raw
+        self._rules: dict[str, Rule] = {}
+        # flattened: each visible name maps straight to the (innermost)
+        # repository defining it rather than walking up the parents
+        self._owners = dict.fromkeys(raw, self)
+        if parent is not None:
+            self._owners = {**parent._owners, **self._owners}
+
+    def __getitem__(self, key: str) -> Rule:
+        owner = self._owners[key]
+        try:
+            return owner._rules[key]
+        except KeyError:
+            pass
+
+        ret = owner._rules[key] = Rule.make(owner._raw[key], owner)
+        return ret
+
+
 @uniquely_constructed
 class Grammar(NamedTuple):
     scope_name: str
-    repository: FChainMap[str, Rule]
+    repository: _Repository
     patterns: tuple[Rule, ...]
 
     @classmethod
     def make(cls, data: dict[str, Any]) -> Grammar:
         scope_name = data['scopeName']
-        if 'repository' in data:
-            # this looks odd, but it's so we can have a self-referential
-            # immutable-after-construction chain map
-            repository_dct: dict[str, Rule] = {}
-            repository = FChainMap(repository_dct)
-            for k, dct in data['repository'].items():
-                repository_dct[k] = Rule.make(dct, repository)
-        else:
-            repository = FChainMap()
+        repository = _Repository(data.get('repository', {}), None)
         patterns = tuple(Rule.make(d, repository) for d in data['patterns'])
         return cls(
             scope_name=scope_name,
@@ -179,10 +206,90 @@ class Region(NamedTuple):
     scope: Scope
 
 
-class State(NamedTuple):
+class _ScopeNode(tuple[str, ...]):
+    """interned scope stack: pushing the same names always gives the same node
+
+    scopes aren't rebuilt for every token and the per-scope caches (theme /
+    attribute lookups, `Entry` interning) find their keys by identity
+    """
+
+    _children: dict[tuple[str, ...], _ScopeNode]
+
+    def __new__(cls, names: Iterable[str]) -> _ScopeNode:
+        ret = super().__new__(cls, names)
+        ret._children = {}
+        return ret
+
+    def __reduce__(self) -> tuple[type[tuple[str, ...]], tuple[Scope]]:
+        # the children only matter to this process, send a plain tuple
+        return tuple, (tuple(self),)
+
+    def push(self, names: tuple[str, ...]) -> _ScopeNode:
+        if not names:
+            return self
+        ret = self._children.get(names)
+        if ret is None:
+            ret = self._children[names] = _ScopeNode((*self, *names))
+        return ret
+
+
+class _InternTable(Generic[T]):
+    """weak-valued table for hash-consing
+
+    dead references are swept in bulk as the table grows which is much
+    cheaper than `weakref.WeakValueDictionary`'s per-object callbacks
+    """
+
+    def __init__(self) -> None:
+        self._refs: dict[tuple[Any, ...], weakref.ref[T]] = {}
+        self._limit = 1024
+
+    def get(self, key: tuple[Any, ...]) -> T | None:
+        ref = self._refs.get(key)
+        return None if ref is None else ref()
+
+    def add(self, key: tuple[Any, ...], value: T) -> None:
+        self._refs[key] = weakref.ref(value)
+        if len(self._refs) > self._limit:
+            self._refs = {
+                k: ref for k, ref in self._refs.items() if ref() is not None
+            }
+            self._limit = max(1024, 2 * len(self._refs))
+
+
+class State:
+    """hash-consed: equal stacks are always the same object
+
+    this makes hashing / comparing states (the highlight cache keys) O(1)
+    """
+    __slots__ = ('entries', 'while_stack', '__weakref__')
+
     entries: tuple[Entry, ...]
     while_stack: tuple[tuple[WhileRule, int], ...]
 
+    _interned: _InternTable[State] = _InternTable()
+
+    def __new__(
+            cls,
+            entries: tuple[Entry, ...],
+            while_stack: tuple[tuple[WhileRule, int], ...],
+    ) -> State:
+        key = (entries, while_stack)
+        ret = cls._interned.get(key)
+        if ret is None:
+            ret = super().__new__(cls)
+            ret.entries = entries
+            ret.while_stack = while_stack
+            cls._interned.add(key, ret)
+        return ret
+
+    def __repr__(self) -> str:
+        return (
+            f'{type(self).__name__}('
+            f'entries={self.entries!r}, while_stack={self.while_stack!r}'
+            f')'
+        )
+
     @classmethod
     def root(cls, entry: Entry) -> State:
         return cls((entry,), ())
@@ -192,29 +299,27 @@ class State(NamedTuple):
         return self.entries[-1]
 
     def push(self, entry: Entry) -> State:
-        return self._replace(entries=(*self.entries, entry))
+        return State((*self.entries, entry), self.while_stack)
 
     def pop(self) -> State:
-        return self._replace(entries=self.entries[:-1])
+        return State(self.entries[:-1], self.while_stack)
 
     def push_while(self, rule: WhileRule, entry: Entry) -> State:
         entries = (*self.entries, entry)
         while_stack = (*self.while_stack, (rule, len(entries)))
-        return self._replace(entries=entries, while_stack=while_stack)
-
-    def pop_while(self) -> State:
-        entries, while_stack = self.entries[:-1], self.while_stack[:-1]
-        return self._replace(entries=entries, while_stack=while_stack)
+        return State(entries, while_stack)
 
 
 class CompiledRule(Protocol):
     @property
     def name(self) -> tuple[str, ...]: ...
 
+    def __hash__(self) -> int: ...
+
     def start(
             self,
             compiler: Compiler,
-            match: Match[str],
+            match: Match,
             state: State,
     ) -> tuple[State, bool, Regions]:
         ...
@@ -238,36 +343,69 @@ class CompiledRegsetRule(CompiledRule, Protocol):
     def u_rules(self) -> tuple[Rule, ...]: ...
 
 
-class Entry(NamedTuple):
-    scope: tuple[str, ...]
+class Entry:
+    """hash-consed (see `State`)"""
+    __slots__ = ('scope', 'rule', 'start', 'reg', 'boundary', '__weakref__')
+
+    scope: _ScopeNode
     rule: CompiledRule
     start: tuple[str, int]
-    reg: _Reg = ERR_REG
-    boundary: bool = False
+    reg: _Reg
+    boundary: bool
+
+    _interned: _InternTable[Entry] = _InternTable()
+
+    def __new__(
+            cls,
+            scope: _ScopeNode,
+            rule: CompiledRule,
+            start: tuple[str, int],
+            reg: _Reg = ERR_REG,
+            boundary: bool = False,
+    ) -> Entry:
+        key = (scope, rule, start, reg, boundary)
+        ret = cls._interned.get(key)
+        if ret is None:
+            ret = super().__new__(cls)
+            ret.scope, ret.rule, ret.start, ret.reg, ret.boundary = key
+            cls._interned.add(key, ret)
+        return ret
+
+    def __repr__(self) -> str:
+        return (
+            f'{type(self).__name__}('
+            f'scope={self.scope!r}, rule={self.rule!r}, '
+            f'start={self.start!r}, reg={self.reg!r}, '
+            f'boundary={self.boundary!r}'
+            f')'
+        )
 
 
 def _inner_capture_parse(
         compiler: Compiler,
         start: int,
         s: str,
-        scope: Scope,
+        scope: _ScopeNode,
         rule: CompiledRule,
 ) -> Regions:
-    state = State.root(Entry(scope + rule.name, rule, (s, 0)))
-    _, regions = highlight_line(compiler, state, s, first_line=False)
+    regions = compiler._capture_regions(s, scope, rule)
     return tuple(
         r._replace(start=r.start + start, end=r.end + start) for r in regions
     )
 
 
+def _region_end(region: Region) -> int:
+    return region.end
+
+
 def _captures(
         compiler: Compiler,
-        scope: Scope,
-        match: Match[str],
+        scope: _ScopeNode,
+        match: Match,
         captures: Captures,
 ) -> Regions:
     ret: list[Region] = []
-    pos, pos_end = match.span()
+    pos, pos_end = match.start, match.end
     for i, u_rule in captures:
         try:
             group_s = match[i]
@@ -279,12 +417,12 @@ def _captures(
         rule = compiler.compile_rule(u_rule)
         start, end = match.span(i)
         if start < pos:
-            # TODO: could maybe bisect but this is probably fast enough
-            j = len(ret) - 1
-            while j > 0 and start < ret[j - 1].end:
-                j -= 1
+            # the regions so far are contiguous, split the one containing
+            # the start of this (nested) capture
+            j = bisect.bisect_right(ret, start, key=_region_end)
 
             oldtok = ret[j]
+            assert isinstance(oldtok.scope, _ScopeNode), oldtok
             newtok = []
             if start > oldtok.start:
                 newtok.append(oldtok._replace(end=start))
@@ -315,7 +453,7 @@ def _captures(
 
 def _do_regset(
         idx: int,
-        match: Match[str] | None,
+        match: Match | None,
         rule: CompiledRegsetRule,
         compiler: Compiler,
         state: State,
@@ -325,14 +463,14 @@ def _do_regset(
         return None
 
     ret = []
-    if match.start() > pos:
-        ret.append(Region(pos, match.start(), state.cur.scope))
+    if match.start > pos:
+        ret.append(Region(pos, match.start, state.cur.scope))
 
     target_rule = compiler.compile_rule(rule.u_rules[idx])
     state, boundary, regions = target_rule.start(compiler, match, state)
     ret.extend(regions)
 
-    return state, match.end(), boundary, tuple(ret)
+    return state, match.end, boundary, tuple(ret)
 
 
 @uniquely_constructed
@@ -344,7 +482,7 @@ class PatternRule(NamedTuple):
     def start(
             self,
             compiler: Compiler,
-            match: Match[str],
+            match: Match,
             state: State,
     ) -> tuple[State, bool, Regions]:
         raise AssertionError(f'unreachable {self}')
@@ -370,10 +508,10 @@ class MatchRule(NamedTuple):
     def start(
             self,
             compiler: Compiler,
-            match: Match[str],
+            match: Match,
             state: State,
     ) -> tuple[State, bool, Regions]:
-        scope = state.cur.scope + self.name
+        scope = state.cur.scope.push(self.name)
         return state, False, _captures(compiler, scope, match, self.captures)
 
     def search(
@@ -401,15 +539,15 @@ class EndRule(NamedTuple):
     def start(
             self,
             compiler: Compiler,
-            match: Match[str],
+            match: Match,
             state: State,
     ) -> tuple[State, bool, Regions]:
-        scope = state.cur.scope + self.name
-        next_scope = scope + self.content_name
+        scope = state.cur.scope.push(self.name)
+        next_scope = scope.push(self.content_name)
 
-        boundary = match.end() == len(match.string)
-        reg = make_reg(expand_escaped(match, self.end))
-        start = (match.string, match.start())
+        boundary = match.end == len(match.string)
+        reg = make_backref_reg(match, self.end)
+        start = (match.string, match.start)
         state = state.push(Entry(next_scope, self, start, reg, boundary))
         regions = _captures(compiler, scope, match, self.begin_captures)
         return state, True, regions
@@ -419,21 +557,21 @@ class EndRule(NamedTuple):
             compiler: Compiler,
             state: State,
             pos: int,
-            m: Match[str],
+            m: Match,
     ) -> tuple[State, int, bool, Regions]:
         ret = []
-        if m.start() > pos:
-            ret.append(Region(pos, m.start(), state.cur.scope))
+        if m.start > pos:
+            ret.append(Region(pos, m.start, state.cur.scope))
         ret.extend(_captures(compiler, state.cur.scope, m, self.end_captures))
         # this is probably a bug in the grammar, but it pushed and popped at
         # the same position.
         # we'll advance the highlighter by one position to get past the loop
         # this appears to be what vs code does as well
-        if state.entries[-1].start == (m.string, m.end()):
-            ret.append(Region(m.end(), m.end() + 1, state.cur.scope))
-            end = m.end() + 1
+        if state.entries[-1].start == (m.string, m.end):
+            ret.append(Region(m.end, m.end + 1, state.cur.scope))
+            end = m.end + 1
         else:
-            end = m.end()
+            end = m.end
         return state.pop(), end, False, tuple(ret)
 
     def search(
@@ -446,14 +584,14 @@ class EndRule(NamedTuple):
             boundary: bool,
     ) -> tuple[State, int, bool, Regions] | None:
         end_match = state.cur.reg.search(line, pos, first_line, boundary)
-        if end_match is not None and end_match.start() == pos:
+        if end_match is not None and end_match.start == pos:
             return self._end_ret(compiler, state, pos, end_match)
         elif end_match is None:
             idx, match = self.regset.search(line, pos, first_line, boundary)
             return _do_regset(idx, match, self, compiler, state, pos)
         else:
             idx, match = self.regset.search(line, pos, first_line, boundary)
-            if match is None or end_match.start() <= match.start():
+            if match is None or end_match.start <= match.start:
                 return self._end_ret(compiler, state, pos, end_match)
             else:
                 return _do_regset(idx, match, self, compiler, state, pos)
@@ -472,15 +610,15 @@ class WhileRule(NamedTuple):
     def start(
             self,
             compiler: Compiler,
-            match: Match[str],
+            match: Match,
             state: State,
     ) -> tuple[State, bool, Regions]:
-        scope = state.cur.scope + self.name
-        next_scope = scope + self.content_name
+        scope = state.cur.scope.push(self.name)
+        next_scope = scope.push(self.content_name)
 
-        boundary = match.end() == len(match.string)
-        reg = make_reg(expand_escaped(match, self.while_))
-        start = (match.string, match.start())
+        boundary = match.end == len(match.string)
+        reg = make_backref_reg(match, self.while_)
+        start = (match.string, match.start)
         entry = Entry(next_scope, self, start, reg, boundary)
         state = state.push_while(self, entry)
         regions = _captures(compiler, scope, match, self.begin_captures)
@@ -489,18 +627,18 @@ class WhileRule(NamedTuple):
     def continues(
             self,
             compiler: Compiler,
-            state: State,
+            entry: Entry,
             line: str,
             pos: int,
             first_line: bool,
             boundary: bool,
     ) -> tuple[int, bool, Regions] | None:
-        match = state.cur.reg.match(line, pos, first_line, boundary)
+        match = entry.reg.match(line, pos, first_line, boundary)
         if match is None:
             return None
 
-        ret = _captures(compiler, state.cur.scope, match, self.while_captures)
-        return match.end(), True, ret
+        ret = _captures(compiler, entry.scope, match, self.while_captures)
+        return match.end, True, ret
 
     def search(
             self,
@@ -519,13 +657,19 @@ class Compiler:
     def __init__(self, grammar: Grammar, grammars: Grammars) -> None:
         self._include = functools.cache(self._include_)
         self._patterns = functools.cache(self._patterns_)
+        # the same captured text (keywords, punctuation, ...) is parsed over
+        # and over -- bounded since the text itself is unbounded
+        self._capture_regions = functools.lru_cache(maxsize=4096)(
+            self._capture_regions_,
+        )
 
         self.root_scope = grammar.scope_name
         self._grammars = grammars
         self._rule_to_grammar: dict[Rule, Grammar] = {}
         self._c_rules: dict[Rule, CompiledRule] = {}
         root = self._compile_root(grammar)
-        self.root_state = State.root(Entry(root.name, root, ('', 0)))
+        root_scope = _ScopeNode(root.name)
+        self.root_state = State.root(Entry(root_scope, root, ('', 0)))
 
     def _visit_rule(self, grammar: Grammar, rule: Rule) -> Rule:
         self._rule_to_grammar[rule] = grammar
@@ -534,7 +678,7 @@ class Compiler:
     def _include_(
             self,
             grammar: Grammar,
-            repository: FChainMap[str, Rule],
+            repository: _Repository,
             s: str,
     ) -> tuple[list[str], tuple[Rule, ...]]:
         if s == '$self':
@@ -580,6 +724,16 @@ class Compiler:
                 raise AssertionError(f'unreachable {rule}')
         return ret_regs, tuple(ret_rules)
 
+    def _capture_regions_(
+            self,
+            s: str,
+            scope: _ScopeNode,
+            rule: CompiledRule,
+    ) -> Regions:
+        state = State.root(Entry(scope.push(rule.name), rule, (s, 0)))
+        _, regions = highlight_line(self, state, s, first_line=False)
+        return regions
+
     def _captures_ref(
             self,
             grammar: Grammar,
@@ -633,22 +787,117 @@ class Compiler:
         return ret
 
 
+def _read_cache(filename: str, key: object) -> Any:
+    try:
+        with open(filename, 'rb') as f:
+            if pickle.load(f) == key:
+                return pickle.load(f)
+    except (
+            OSError,
+            EOFError,
+            pickle.UnpicklingError,
+            AttributeError,
+            ImportError,
+    ):  # missing, truncated, or from an older babi
+        pass
+    return None
+
+
+def _write_cache(filename: str, key: object, value: object) -> None:
+    # the cache is best-effort: unwritable directories or values too deeply
+    # nested to pickle are simply not cached
+    with contextlib.suppress(OSError, RecursionError):
+        dirname = os.path.dirname(filename)
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp_filename = tempfile.mkstemp(dir=dirname)
+        try:
+            with open(fd, 'wb') as f:
+                pickle.dump(key, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_filename, filename)
+        except BaseException:
+            os.remove(tmp_filename)
+            raise
+
+
+# bump when the pickled objects change shape -- an editable install does
+# not change the version
+_CACHE_FORMAT = 1
+
+
+@functools.cache
+def _babi_version() -> str:
+    return importlib.metadata.version('babi')
+
+
+class _FileIndex(NamedTuple):
+    file_types: dict[str, str]
+    first_line: tuple[tuple[str, str], ...]
+
+
+def _grammar_files(directories: Iterable[str]) -> dict[str, str]:
+    return {
+        os.path.splitext(filename)[0]: os.path.join(directory, filename)
+        for directory in directories
+        if os.path.exists(directory)
+        for filename in sorted(os.listdir(directory))
+        if filename.endswith('.json')
+    }
+
+
+def _grammar_stamp(grammar_paths: Iterable[str]) -> tuple[object, ...]:
+    ret = []
+    for grammar_path in grammar_paths:
+        stat = os.stat(grammar_path)
+        ret.append((grammar_path, stat.st_mtime_ns, stat.st_size))
+    return tuple(ret)
+
+
+_SHARED: dict[
+    tuple[tuple[str, ...], str | None],
+    tuple[tuple[object, ...], Grammars],
+] = {}
+
+
 class Grammars:
-    def __init__(self, *directories: str) -> None:
-        self._scope_to_files = {
-            os.path.splitext(filename)[0]: os.path.join(directory, filename)
-            for directory in directories
-            if os.path.exists(directory)
-            for filename in sorted(os.listdir(directory))
-            if filename.endswith('.json')
-        }
+    def __init__(
+            self,
+            *directories: str,
+            cache_dir: str | None = None,
+    ) -> None:
+        self._scope_to_files = _grammar_files(directories)
 
         unknown_grammar = {'scopeName': 'source.unknown', 'patterns': []}
         self._raw = {'source.unknown': unknown_grammar}
-        self._file_types: list[tuple[frozenset[str], str]] = []
-        self._first_line: list[tuple[_Reg, str]] = []
+        self._file_index: _FileIndex | None = None
         self._parsed: dict[str, Grammar] = {}
         self._compiled: dict[str, Compiler] = {}
+        self._cache_dir = cache_dir
+
+    @classmethod
+    def shared(
+            cls,
+            *directories: str,
+            cache_dir: str | None = None,
+    ) -> Grammars:
+        """the process-wide instance for `directories`
+
+        parsed and compiled grammars are kept until a grammar file is added,
+        removed, or modified
+        """
+        stamp = _grammar_stamp(_grammar_files(directories).values())
+        key = (directories, cache_dir)
+        try:
+            prev_stamp, ret = _SHARED[key]
+        except KeyError:
+            pass
+        else:
+            if prev_stamp == stamp:
+                return ret
+
+        ret = cls(*directories, cache_dir=cache_dir)
+        _SHARED[key] = (stamp, ret)
+        return ret
 
     def _raw_for_scope(self, scope: str) -> dict[str, Any]:
         try:
@@ -656,16 +905,9 @@ class Grammars:
         except KeyError:
             pass
 
-        grammar_path = self._scope_to_files.pop(scope)
+        grammar_path = self._scope_to_files[scope]
         with open(grammar_path, encoding='UTF-8') as f:
             ret = self._raw[scope] = json.load(f)
-
-        file_types = frozenset(ret.get('fileTypes', ()))
-        first_line = make_reg(ret.get('firstLineMatch', '$impossible^'))
-
-        self._file_types.append((file_types, scope))
-        self._first_line.append((first_line, scope))
-
         return ret
 
     def grammar_for_scope(self, scope: str) -> Grammar:
@@ -674,10 +916,32 @@ class Grammars:
         except KeyError:
             pass
 
-        raw = self._raw_for_scope(scope)
-        ret = self._parsed[scope] = Grammar.make(raw)
+        if self._cache_dir is not None and scope in self._scope_to_files:
+            ret = self._parsed[scope] = self._cached_grammar(scope)
+        else:
+            raw = self._raw_for_scope(scope)
+            ret = self._parsed[scope] = Grammar.make(raw)
         return ret
 
+    def _cached_grammar(self, scope: str) -> Grammar:
+        assert self._cache_dir is not None
+        grammar_path = os.path.abspath(self._scope_to_files[scope])
+        stat = os.stat(grammar_path)
+        key = (
+            _CACHE_FORMAT,
+            _babi_version(),
+            grammar_path,
+            stat.st_mtime_ns,
+            stat.st_size,
+        )
+        cache_path = os.path.join(self._cache_dir, f'{scope}.pickle')
+
+        grammar: Grammar | None = _read_cache(cache_path, key)
+        if grammar is None:
+            grammar = Grammar.make(self._raw_for_scope(scope))
+            _write_cache(cache_path, key, grammar)
+        return grammar
+
     def compiler_for_scope(self, scope: str) -> Compiler:
         try:
             return self._compiled[scope]
@@ -691,6 +955,36 @@ class Grammars:
     def blank_compiler(self) -> Compiler:
         return self.compiler_for_scope('source.unknown')
 
+    def _make_file_index(self) -> _FileIndex:
+        file_types: dict[str, str] = {}
+        first_line = []
+        for scope in self._scope_to_files:
+            raw = self._raw_for_scope(scope)
+            for file_type in raw.get('fileTypes', ()):
+                file_types.setdefault(file_type, scope)
+            if 'firstLineMatch' in raw:
+                first_line.append((raw['firstLineMatch'], scope))
+        return _FileIndex(file_types, tuple(first_line))
+
+    def _get_file_index(self) -> _FileIndex:
+        if self._file_index is not None:
+            return self._file_index
+        elif self._cache_dir is None:
+            self._file_index = self._make_file_index()
+            return self._file_index
+
+        # only the stats are needed to know whether the index is current
+        stamp = _grammar_stamp(self._scope_to_files.values())
+        key = (_CACHE_FORMAT, _babi_version(), stamp)
+        cache_path = os.path.join(self._cache_dir, 'index.pickle')
+
+        file_index: _FileIndex | None = _read_cache(cache_path, key)
+        if file_index is None:
+            file_index = self._make_file_index()
+            _write_cache(cache_path, key, file_index)
+        self._file_index = file_index
+        return file_index
+
     def compiler_for_file(self, filename: str, first_line: str) -> Compiler:
         try:
             tags = tags_from_path(filename)
@@ -703,43 +997,42 @@ class Grammars:
             except KeyError:
                 pass
 
-        # didn't find it in the fast path, need to read all the json
-        for k in tuple(self._scope_to_files):
-            self._raw_for_scope(k)
+        # didn't find it in the fast path, consult the fileTypes /
+        # firstLineMatch of every grammar
+        file_index = self._get_file_index()
 
         _, _, ext = os.path.basename(filename).rpartition('.')
-        for extensions, scope in self._file_types:
-            if ext in extensions:
-                return self.compiler_for_scope(scope)
+        if ext in file_index.file_types:
+            return self.compiler_for_scope(file_index.file_types[ext])
 
-        for reg, scope in self._first_line:
+        for reg_s, scope in file_index.first_line:
+            reg = make_reg(reg_s)
             if reg.match(first_line, 0, first_line=True, boundary=True):
                 return self.compiler_for_scope(scope)
 
         return self.compiler_for_scope('source.unknown')
 
 
-def highlight_line(
+def highlight_line_into(
         compiler: Compiler,
         state: State,
         line: str,
         first_line: bool,
-) -> tuple[State, Regions]:
-    ret: list[Region] = []
+        ret: list[Region],
+) -> State:
+    """tokenize `line`, appending its regions to `ret`"""
     pos = 0
     boundary = state.cur.boundary
 
-    # TODO: this is still a little wasteful
-    while_stack = []
-    for while_rule, idx in state.while_stack:
-        while_stack.append((while_rule, idx))
-        while_state = State(state.entries[:idx], tuple(while_stack))
-
+    # each while rule only needs its own entry, a new state is only made
+    # for the first one which doesn't continue (dropping it and everything
+    # pushed after it)
+    for i, (while_rule, idx) in enumerate(state.while_stack):
         while_res = while_rule.continues(
-            compiler, while_state, line, pos, first_line, boundary,
+            compiler, state.entries[idx - 1], line, pos, first_line, boundary,
         )
         if while_res is None:
-            state = while_state.pop_while()
+            state = State(state.entries[:idx - 1], state.while_stack[:i])
             break
         else:
             pos, boundary, regions = while_res
@@ -759,4 +1052,35 @@ def highlight_line(
     if pos < len(line):
         ret.append(Region(pos, len(line), state.cur.scope))
 
+    clear_searches()
+    return state
+
+
+def highlight_line(
+        compiler: Compiler,
+        state: State,
+        line: str,
+        first_line: bool,
+) -> tuple[State, Regions]:
+    ret: list[Region] = []
+    state = highlight_line_into(compiler, state, line, first_line, ret)
     return state, tuple(ret)
+
+
+def highlight_lines(
+        compiler: Compiler,
+        state: State,
+        lines: Iterable[str],
+        first_line: bool,
+) -> Generator[tuple[State, list[Region]]]:
+    """tokenize a run of lines, `first_line` applies to the first of them
+
+    to avoid per-line allocations the yielded regions list is reused for
+    every line -- copy it if it needs to outlive the iteration
+    """
+    ret: list[Region] = []
+    for line in lines:
+        state = highlight_line_into(compiler, state, line, first_line, ret)
+        yield state, ret
+        ret.clear()
+        first_line = False
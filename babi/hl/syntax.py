@@ -1,93 +1,150 @@
 from __future__ import annotations
 
+import abc
 import curses
 import functools
 import math
+import time
+import weakref
 from collections.abc import Callable
+from collections.abc import Iterable
 from typing import NamedTuple
+from typing import TypeVar
 
 from babi.buf import Buf
 from babi.color_manager import ColorManager
 from babi.highlight import Compiler
 from babi.highlight import Grammars
-from babi.highlight import highlight_line
+from babi.highlight import highlight_line_into
+from babi.highlight import Region
+from babi.highlight import Scope
 from babi.highlight import State
 from babi.hl.interface import HL
 from babi.hl.interface import HLs
 from babi.theme import Theme
+from babi.tokenizer import Tokenizer
+from babi.tokenizer import Tokens
 from babi.user_data import prefix_data
+from babi.user_data import xdg_cache
 from babi.user_data import xdg_config
 from babi.user_data import xdg_data
 
+T = TypeVar('T')
 
-class FileSyntax:
+# lines longer than this are not tokenized (they are drawn without syntax
+# highlighting) -- regexes would otherwise be run over the whole line for
+# every token on it
+HIGHLIGHT_LIMIT = 20000
+
+# time (in seconds) to spend tokenizing per frame -- the rest of the lines
+# are drawn without highlighting and are finished on the following frames
+_BUDGET = .05
+
+# lines sent to the tokenizer process at a time
+_BATCH = 100
+
+
+def _runs(
+        regions: Iterable[tuple[int, int, T]],
+        length: int,
+        attr: Callable[[T], int | None],
+) -> HLs:
+    # merge adjacent regions with the same attribute into runs as they are
+    # converted, leaving out regions in the default style
+    regs: list[HL] = []
+    run_x = run_end = run_attr = -1
+    for start, end, scope in regions:
+        scope_attr = attr(scope)
+        if scope_attr is None:
+            continue
+        elif scope_attr == run_attr and start == run_end:
+            run_end = end
+        else:
+            if run_attr != -1:
+                regs.append(HL(x=run_x, end=run_end, attr=run_attr))
+            run_x, run_end, run_attr = start, end, scope_attr
+    if run_attr != -1:
+        # the trailing newline is not drawn
+        run_end = min(run_end, length)
+        regs.append(HL(x=run_x, end=run_end, attr=run_attr))
+    return tuple(regs)
+
+
+class BaseFileSyntax(abc.ABC):
+    """a file's highlighter, the lines are tokenized a frame at a time
+
+    subclasses keep whatever lets a line be restyled without retokenizing it
+    so a theme change only restyles the lines as they come into view
+    """
     include_edge = False
 
     def __init__(
             self,
-            compiler: Compiler,
+            root_scope: str,
             theme: Theme,
             color_manager: ColorManager,
     ) -> None:
-        self._compiler = compiler
+        self.root_scope = root_scope
         self._theme = theme
         self._color_manager = color_manager
 
         self.regions: list[HLs] = []
-        self._states: list[State] = []
-
-        # this will be assigned a functools.lru_cache per instance for
-        # better hit rate and memory usage
-        self._hl: Callable[[State, str, bool], tuple[State, HLs]] | None
-        self._hl = None
+        # lines whose regions were styled with a previous theme
+        self._stale = bytearray()
+        self.pending = False
+        self.highlight_limit = HIGHLIGHT_LIMIT
 
     @property
-    def root_scope(self) -> str:
-        return self._compiler.root_scope
+    def failed(self) -> bool:
+        """whether this can no longer highlight and should be replaced"""
+        return False
 
-    def _hl_uncached(
-            self,
-            state: State,
-            line: str,
-            first_line: bool,
-    ) -> tuple[State, HLs]:
-        new_state, regions = highlight_line(
-            self._compiler, state, f'{line}\n', first_line=first_line,
-        )
+    def _attr_uncached(self, scope: Scope) -> int | None:
+        style = self._theme.select(scope)
+        if style == self._theme.default:
+            return None
+        else:
+            return style.attr(self._color_manager)
 
-        # remove the trailing newline
-        new_end = regions[-1]._replace(end=regions[-1].end - 1)
-        regions = regions[:-1] + (new_end,)
+    def _skipped(self, line: str) -> HLs:
+        # lines over the highlight limit are dimmed so they are not mistaken
+        # for text with no syntax to highlight
+        attr = self._theme.default.attr(self._color_manager) | curses.A_DIM
+        return (HL(x=0, end=len(line), attr=attr),)
 
-        regs: list[HL] = []
-        for r in regions:
-            style = self._theme.select(r.scope)
-            if style == self._theme.default:
-                continue
+    @abc.abstractmethod
+    def _tokenized(self) -> int:
+        """the number of lines tokenized so far"""
 
-            attr = style.attr(self._color_manager)
-            if (
-                    regs and
-                    regs[-1].attr == attr and
-                    regs[-1].end == r.start
-            ):
-                regs[-1] = regs[-1]._replace(end=r.end)
-            else:
-                regs.append(HL(x=r.start, end=r.end, attr=attr))
+    @abc.abstractmethod
+    def _tokenize_until(self, lines: Buf, idx: int, deadline: float) -> None:
+        """tokenize (and style) lines up to `idx` until the deadline"""
 
-        return new_state, tuple(regs)
+    @abc.abstractmethod
+    def _restyle(self, lines: Buf, idx: int) -> HLs:
+        """style an already tokenized line again"""
 
-    def _set_cb(self, lines: Buf, idx: int, victim: str) -> None:
+    def _invalidate(self, idx: int) -> None:
         del self.regions[idx:]
-        del self._states[idx:]
+        del self._stale[idx:]
+
+    def set_theme(self, theme: Theme, color_manager: ColorManager) -> None:
+        self._theme = theme
+        self._color_manager = color_manager
+        self._stale = bytearray(b'\x01') * self._tokenized()
+
+    def set_highlight_limit(self, limit: int) -> None:
+        self.highlight_limit = limit
+        self._invalidate(0)
+
+    def _set_cb(self, lines: Buf, idx: int, victim: str) -> None:
+        self._invalidate(idx)
 
     def _del_cb(self, lines: Buf, idx: int, victim: str) -> None:
-        del self.regions[idx:]
-        del self._states[idx:]
+        self._invalidate(idx)
 
     def _ins_cb(self, lines: Buf, idx: int) -> None:
-        del self.regions[idx:]
-        del self._states[idx:]
+        self._invalidate(idx)
 
     def register_callbacks(self, buf: Buf) -> None:
         buf.add_set_callback(self._set_cb)
@@ -95,6 +152,58 @@ class FileSyntax:
         buf.add_ins_callback(self._ins_cb)
 
     def highlight_until(self, lines: Buf, idx: int) -> None:
+        # drop the placeholders for lines which ran out of time last frame
+        del self.regions[self._tokenized():]
+
+        self._tokenize_until(lines, idx, time.monotonic() + _BUDGET)
+
+        self.pending = self._tokenized() < idx
+        self.regions.extend(() for _ in range(len(self.regions), idx))
+
+        for i in range(lines.file_y, min(idx, len(self._stale))):
+            if self._stale[i]:
+                self._stale[i] = 0
+                self.regions[i] = self._restyle(lines, i)
+
+
+class FileSyntax(BaseFileSyntax):
+    def __init__(
+            self,
+            compiler: Compiler,
+            theme: Theme,
+            color_manager: ColorManager,
+    ) -> None:
+        super().__init__(compiler.root_scope, theme, color_manager)
+        self._compiler = compiler
+        self._states: list[State] = []
+
+        # this will be assigned a functools.lru_cache per instance for
+        # better hit rate and memory usage
+        self._hl: Callable[[State, str, bool], tuple[State, HLs]] | None
+        self._hl = None
+        # the same scopes come up over and over, resolve each to its curses
+        # attribute once (None for the theme's default style)
+        self._attr = functools.cache(self._attr_uncached)
+
+    def _hl_uncached(
+            self,
+            state: State,
+            line: str,
+            first_line: bool,
+    ) -> tuple[State, HLs]:
+        if len(line) > self.highlight_limit:
+            return state, self._skipped(line)
+
+        regions: list[Region] = []
+        new_state = highlight_line_into(
+            self._compiler, state, f'{line}\n', first_line, regions,
+        )
+        return new_state, _runs(regions, len(line), self._attr)
+
+    def _tokenized(self) -> int:
+        return len(self._states)
+
+    def _tokenize_until(self, lines: Buf, idx: int, deadline: float) -> None:
         if self._hl is None:
             # the docs claim better performance with power of two sizing
             size = max(4096, 2 ** (int(math.log(len(lines), 2)) + 2))
@@ -109,20 +218,173 @@ class FileSyntax:
             state, regions = self._hl(state, lines[i], i == 0)
             self._states.append(state)
             self.regions.append(regions)
+            if time.monotonic() > deadline:
+                break
+
+    def _restyle(self, lines: Buf, idx: int) -> HLs:
+        # the states only depend on the grammar so they are kept and the
+        # line is restyled starting from the previous line's state
+        assert self._hl is not None
+        if idx == 0:
+            state = self._compiler.root_state
+        else:
+            state = self._states[idx - 1]
+        _, regions = self._hl(state, lines[idx], idx == 0)
+        return regions
+
+    def _invalidate(self, idx: int) -> None:
+        super()._invalidate(idx)
+        del self._states[idx:]
+
+    def set_theme(self, theme: Theme, color_manager: ColorManager) -> None:
+        super().set_theme(theme, color_manager)
+        self._attr = functools.cache(self._attr_uncached)
+        self._hl = None
+
+    def set_highlight_limit(self, limit: int) -> None:
+        # already tokenized lines are cached with the previous limit
+        self._hl = None
+        super().set_highlight_limit(limit)
+
+
+class TokenizerFileSyntax(BaseFileSyntax):
+    """like FileSyntax but the lines are tokenized by a worker process
+
+    the tokens of each line are kept so a theme change only restyles them
+    """
+
+    def __init__(
+            self,
+            tokenizer: Tokenizer,
+            compiler: Compiler,
+            filename: str | None,
+            first_line: str,
+            theme: Theme,
+            color_manager: ColorManager,
+    ) -> None:
+        super().__init__(compiler.root_scope, theme, color_manager)
+        self._tokenizer = tokenizer
+        self._doc = tokenizer.new_doc()
+        weakref.finalize(self, tokenizer.forget, self._doc)
+        # the worker picks the grammar from these
+        self._filename = filename
+        self._first_line = first_line
+
+        self._tokens: list[Tokens] = []
+        # bumped when lines still being tokenized are invalidated, the batch
+        # is thrown away when it arrives
+        self._generation = 0
+        self._waiting = False
+        self._sent_end = 0
+
+        # by scope number, see `Tokenizer.scopes`
+        self._attrs: list[int | None] = []
+
+    @property
+    def failed(self) -> bool:
+        return self._tokenizer.dead
+
+    def _styled(self) -> Callable[[int], int | None]:
+        # style each scope the worker has numbered since the last time
+        scopes = self._tokenizer.scopes
+        for scope in scopes[len(self._attrs):]:
+            self._attrs.append(self._attr_uncached(scope))
+        return self._attrs.__getitem__
+
+    def _tokenized(self) -> int:
+        return len(self._tokens)
+
+    def _tokenize_until(self, lines: Buf, idx: int, deadline: float) -> None:
+        while len(self._tokens) < idx:
+            if not self._waiting:
+                start = len(self._tokens)
+                end = min(idx, start + _BATCH)
+                # another file's batch is only waited on until the deadline
+                if not self._tokenizer.send(
+                        self._doc,
+                        self._generation,
+                        self._filename,
+                        self._first_line,
+                        start,
+                        tuple(lines[i] for i in range(start, end)),
+                        self.highlight_limit,
+                        max(deadline - time.monotonic(), 0),
+                ):
+                    break
+                self._waiting = True
+                self._sent_end = end
+
+            timeout = max(deadline - time.monotonic(), 0)
+            tokenized = self._tokenizer.result(self._doc, timeout)
+            if tokenized is None:
+                break
+
+            self._waiting = False
+            if tokenized.generation == self._generation:
+                attr = self._styled()
+                for i, tokens in enumerate(tokenized.tokens, tokenized.start):
+                    self._tokens.append(tokens)
+                    self.regions.append(self._style(tokens, lines[i], attr))
+
+    def _style(
+            self,
+            tokens: Tokens,
+            line: str,
+            attr: Callable[[int], int | None],
+    ) -> HLs:
+        if len(line) > self.highlight_limit:
+            return self._skipped(line)
+        else:
+            return _runs(tokens, len(line), attr)
+
+    def _restyle(self, lines: Buf, idx: int) -> HLs:
+        return self._style(self._tokens[idx], lines[idx], self._styled())
+
+    def _invalidate(self, idx: int) -> None:
+        if idx < self._sent_end:
+            self._generation += 1
+        super()._invalidate(idx)
+        del self._tokens[idx:]
+
+    def set_theme(self, theme: Theme, color_manager: ColorManager) -> None:
+        super().set_theme(theme, color_manager)
+        self._attrs = []
 
 
 class Syntax(NamedTuple):
     grammars: Grammars
     theme: Theme
     color_manager: ColorManager
+    tokenizer: Tokenizer | None = None
 
-    def file_highlighter(self, filename: str, first_line: str) -> FileSyntax:
+    def _file_syntax(
+            self,
+            compiler: Compiler,
+            filename: str | None,
+            first_line: str,
+    ) -> BaseFileSyntax:
+        if self.tokenizer is None or self.tokenizer.dead:
+            return FileSyntax(compiler, self.theme, self.color_manager)
+        else:
+            return TokenizerFileSyntax(
+                self.tokenizer,
+                compiler,
+                filename,
+                first_line,
+                self.theme,
+                self.color_manager,
+            )
+
+    def file_highlighter(
+            self,
+            filename: str,
+            first_line: str,
+    ) -> BaseFileSyntax:
         compiler = self.grammars.compiler_for_file(filename, first_line)
-        return FileSyntax(compiler, self.theme, self.color_manager)
+        return self._file_syntax(compiler, filename, first_line)
 
-    def blank_file_highlighter(self) -> FileSyntax:
-        compiler = self.grammars.blank_compiler()
-        return FileSyntax(compiler, self.theme, self.color_manager)
+    def blank_file_highlighter(self) -> BaseFileSyntax:
+        return self._file_syntax(self.grammars.blank_compiler(), None, '')
 
     def _init_screen(self, stdscr: curses._CursesWindow) -> None:
         default_fg, default_bg = self.theme.default.fg, self.theme.default.bg
@@ -147,9 +409,14 @@ class Syntax(NamedTuple):
             cls,
             stdscr: curses._CursesWindow,
             color_manager: ColorManager,
+            tokenizer: Tokenizer | None = None,
     ) -> Syntax:
-        grammars = Grammars(prefix_data('grammar_v1'), xdg_data('grammar_v1'))
+        grammars = Grammars.shared(
+            prefix_data('grammar_v1'),
+            xdg_data('grammar_v1'),
+            cache_dir=xdg_cache('grammar_v1'),
+        )
         theme = Theme.from_filename(xdg_config('theme.json'))
-        ret = cls(grammars, theme, color_manager)
+        ret = cls(grammars, theme, color_manager, tokenizer)
         ret._init_screen(stdscr)
         return ret
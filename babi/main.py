@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import argparse
+import contextlib
 import curses
 import os
 import re
@@ -16,6 +17,11 @@ from babi.screen import EditResult
 from babi.screen import FileInfo
 from babi.screen import make_stdscr
 from babi.screen import Screen
+from babi.tokenizer import Tokenizer
+from babi.tokenizer import tokenizer_process
+from babi.user_data import prefix_data
+from babi.user_data import xdg_cache
+from babi.user_data import xdg_data
 
 CONSOLE = 'CONIN$' if sys.platform == 'win32' else '/dev/tty'
 POSITION_RE = re.compile(r'^\+-?\d+$')
@@ -29,6 +35,13 @@ def _edit(screen: Screen, stdin: str) -> EditResult:
         screen.draw()
         screen.file.move_cursor(screen.stdscr, screen.layout.file)
 
+        # finish highlighting (a frame at a time) until a key is pressed
+        while screen.file.highlight_pending and not screen.has_input():
+            screen.file.draw_pending_highlight(
+                screen.stdscr, screen.layout.file,
+            )
+            screen.file.move_cursor(screen.stdscr, screen.layout.file)
+
         key = screen.get_char()
         if key.keyname in File.DISPATCH:
             File.DISPATCH[key.keyname](screen.file, screen.layout.file)
@@ -48,8 +61,9 @@ def c_main(
         file_infos: list[FileInfo],
         stdin: str,
         perf: Perf,
+        tokenizer: Tokenizer | None = None,
 ) -> int:
-    screen = Screen(stdscr, file_infos, perf)
+    screen = Screen(stdscr, file_infos, perf, tokenizer)
 
     def _exit_current() -> None:
         del screen.files[screen.i]
@@ -146,10 +160,27 @@ def _files(filenames: list[str]) -> list[FileInfo]:
     return ret
 
 
+def _tokenizer(
+        enabled: bool,
+) -> contextlib.AbstractContextManager[Tokenizer | None]:
+    if enabled:
+        return tokenizer_process(
+            prefix_data('grammar_v1'),
+            xdg_data('grammar_v1'),
+            cache_dir=xdg_cache('grammar_v1'),
+        )
+    else:
+        return contextlib.nullcontext()
+
+
 def main(argv: Sequence[str] | None = None) -> int:
     parser = argparse.ArgumentParser()
     parser.add_argument('filenames', metavar='filename', nargs='*')
     parser.add_argument('--perf-log')
+    parser.add_argument(
+        '--tokenizer-process', action='store_true',
+        help='tokenize for syntax highlighting in a separate process',
+    )
     parser.add_argument(
         '--key-debug', action='store_true', help=argparse.SUPPRESS,
     )
@@ -173,7 +204,8 @@ def main(argv: Sequence[str] | None = None) -> int:
             return _key_debug(stdscr, perf)
         else:
             file_infos = _files(args.filenames)
-            return c_main(stdscr, file_infos, stdin, perf)
+            with _tokenizer(args.tokenizer_process) as tokenizer:
+                return c_main(stdscr, file_infos, stdin, perf, tokenizer)
 
 
 if __name__ == '__main__':
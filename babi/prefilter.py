@@ -0,0 +1,273 @@
+"""which characters can a pattern's match start with?
+
+a conservative look at the start of oniguruma patterns: anything not
+understood (\\w, posix classes, case insensitivity, ...) gives up
+"""
+from __future__ import annotations
+
+import re
+
+# a superset of oniguruma's unicode \s (python's also has \x1c-\x1f)
+_SPACE = frozenset(chr(c) for c in range(0x3001) if chr(c).isspace())
+_HEX = frozenset('0123456789abcdefABCDEF')
+_ESCAPES = {
+    'n': frozenset('\n'), 'r': frozenset('\r'), 't': frozenset('\t'),
+    'f': frozenset('\f'), 'v': frozenset('\v'), 'e': frozenset('\x1b'),
+    's': _SPACE, 'h': _HEX,
+}
+_ZERO_WIDTH = ('\\A', '\\b', '\\B', '\\z', '\\Z', '\\G')
+_LOOKAROUND = ('(?=', '(?!', '(?<=', '(?<!', '(?#')
+_QUANTIFIER = re.compile(r'(?:[?*+]|\{(\d*)(?:,\d*)?\})[?+]?')
+
+_Chars = frozenset[str]
+
+
+def _escape(s: str, i: int) -> _Chars | None:
+    # `s[i]` is a backslash
+    c = s[i + 1:i + 2]
+    if c in _ESCAPES:
+        return _ESCAPES[c]
+    elif not c or c.isalnum() or c.isspace():
+        return None
+    else:
+        return frozenset(c)
+
+
+def _class_end(s: str, i: int) -> int:
+    """index after the class starting at `s[i]`, -1 if it isn't closed"""
+    depth = 1
+    i += 1
+    # a leading ] is a literal
+    if s.startswith('^]', i):
+        i += 2
+    elif s.startswith(']', i):
+        i += 1
+    while i < len(s):
+        if s[i] == '\\':
+            i += 1
+        elif s[i] == '[':
+            depth += 1
+        elif s[i] == ']':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return -1
+
+
+def _group_end(s: str, i: int) -> int:
+    """index after the group starting at `s[i]`, -1 if it isn't closed"""
+    depth = 0
+    while i < len(s):
+        if s[i] == '\\':
+            i += 1
+        elif s[i] == '[':
+            i = _class_end(s, i)
+            if i == -1:
+                return -1
+            continue
+        elif s[i] == '(':
+            depth += 1
+        elif s[i] == ')':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return -1
+
+
+def _class(s: str) -> _Chars | None:
+    # `s` is the inside of a character class
+    if not s or s[0] in '^]':
+        return None
+    items: list[str | _Chars] = []
+    i = 0
+    while i < len(s):
+        if s[i] == '\\':
+            chars = _escape(s, i)
+            if chars is None:
+                return None
+            # (escaped characters are never part of a range)
+            items.append(chars)
+            i += 2
+        elif s[i] in '[&':
+            return None
+        else:
+            items.append(s[i])
+            i += 1
+
+    ret: set[str] = set()
+    i = 0
+    while i < len(items):
+        item = items[i]
+        last = items[i + 2] if i + 2 < len(items) else None
+        if isinstance(item, frozenset):
+            ret.update(item)
+            i += 1
+        elif items[i + 1:i + 2] == ['-'] and isinstance(last, str):
+            lo, hi = ord(item), ord(last)
+            if not 0 <= hi - lo <= 256:
+                return None
+            ret.update(chr(c) for c in range(lo, hi + 1))
+            i += 3
+        elif item == '-' and 0 < i < len(items) - 1:
+            return None  # a range with an escape, or a range of ranges
+        else:
+            ret.add(item)
+            i += 1
+    return frozenset(ret)
+
+
+def _atom(s: str, i: int, extended: bool) -> tuple[_Chars, bool, int] | None:
+    """(first characters, can be empty, end index) of the atom at `s[i]`"""
+    if s[i] in '^$':
+        return frozenset(), True, i + 1
+    elif s.startswith(_ZERO_WIDTH, i):
+        return frozenset(), True, i + 2
+    elif s[i] == '\\':
+        chars = _escape(s, i)
+        return None if chars is None else (chars, False, i + 2)
+    elif s[i] == '[':
+        end = _class_end(s, i)
+        chars = _class(s[i + 1:end - 1])
+        return None if chars is None else (chars, False, end)
+    elif s[i] == '(':
+        end = _group_end(s, i)
+        if s.startswith(_LOOKAROUND, i):
+            return frozenset(), True, end
+
+        inner = s[i + 1:end - 1]
+        if inner.startswith(('?:', '?>')):
+            inner = inner[2:]
+        elif inner.startswith('?<'):
+            _, _, inner = inner.partition('>')
+        elif re.match(r'\?-[im]*x?[im]*:', inner):
+            if extended and 'x' in inner[:inner.index(':')]:
+                return None
+            _, _, inner = inner.partition(':')
+        elif inner.startswith('?'):
+            return None
+
+        ret = _first(inner, extended)
+        return None if ret is None else (*ret, end)
+    elif s[i] in '.|?*+)':
+        return None
+    elif s[i] == '{' and _QUANTIFIER.match(s, i):
+        return None
+    else:
+        return frozenset(s[i]), False, i + 1
+
+
+def _sequence(s: str, extended: bool) -> tuple[_Chars, bool] | None:
+    chars: set[str] = set()
+    i = 0
+    while i < len(s):
+        atom = _atom(s, i, extended)
+        if atom is None:
+            return None
+        atom_chars, nullable, i = atom
+
+        quantifier = _QUANTIFIER.match(s, i)
+        if quantifier is not None:
+            if quantifier[0][0] in '?*' or quantifier[1] in ('', '0'):
+                nullable = True
+            i = quantifier.end()
+
+        chars.update(atom_chars)
+        if not nullable:
+            return frozenset(chars), False
+    return frozenset(chars), True
+
+
+def _alternatives(s: str) -> list[str] | None:
+    # (None if a class or group isn't closed, the rest assumes they are)
+    ret = []
+    start = i = 0
+    while i < len(s):
+        if s[i] == '\\':
+            i += 2
+        elif s[i] in '[(':
+            i = (_class_end if s[i] == '[' else _group_end)(s, i)
+            if i == -1:
+                return None
+        elif s[i] == '|':
+            ret.append(s[start:i])
+            start = i = i + 1
+        else:
+            i += 1
+    ret.append(s[start:])
+    return ret
+
+
+def _first(s: str, extended: bool) -> tuple[_Chars, bool] | None:
+    alternatives = _alternatives(s)
+    if alternatives is None:
+        return None
+    chars: set[str] = set()
+    nullable = False
+    for alternative in alternatives:
+        ret = _sequence(alternative, extended)
+        if ret is None:
+            return None
+        chars.update(ret[0])
+        nullable = nullable or ret[1]
+    return frozenset(chars), nullable
+
+
+def _strip_extended(s: str) -> str | None:
+    # (?x): whitespace and comments outside of classes are not part of it
+    ret = []
+    i = 0
+    while i < len(s):
+        if s[i] == '\\':
+            ret.append(s[i:i + 2])
+            i += 2
+        elif s[i] == '[':
+            end = _class_end(s, i)
+            if end == -1:
+                return None
+            ret.append(s[i:end])
+            i = end
+        elif s[i] == '#':
+            end = s.find('\n', i)
+            i = len(s) if end == -1 else end
+        elif s[i].isspace():
+            i += 1
+        else:
+            ret.append(s[i])
+            i += 1
+    return ''.join(ret)
+
+
+def first_chars(s: str) -> _Chars | None:
+    """characters every match of `s` starts with (None: unknown / any)"""
+    extended = s.startswith('(?x)')
+    if extended:
+        stripped = _strip_extended(s[4:])
+        if stripped is None:
+            return None
+        s = stripped
+
+    ret = _first(s, extended)
+    if ret is None or ret[1]:  # could match the empty string anywhere
+        return None
+    else:
+        return ret[0]
+
+
+def make_prefilter(patterns: tuple[str, ...]) -> re.Pattern[str] | None:
+    """a (python) pattern finding where any of `patterns` could match"""
+    chars: set[str] = set()
+    for pattern in patterns:
+        # \\G matches wherever the search starts so it can't be moved
+        if '\\G' in pattern:
+            return None
+        pattern_chars = first_chars(pattern)
+        if pattern_chars is None:
+            return None
+        chars.update(pattern_chars)
+
+    if not chars:
+        return re.compile('(?!)')
+    else:
+        return re.compile(f'[{"".join(re.escape(c) for c in sorted(chars))}]')
@@ -1,11 +1,14 @@
 from __future__ import annotations
 
+import collections
 import functools
 import re
-from re import Match
+from typing import NamedTuple
 
 import onigurumacffi
 
+from babi.prefilter import make_prefilter
+
 _BACKREF_RE = re.compile(r'((?<!\\)(?:\\\\)*)\\([0-9]+)')
 
 
@@ -28,22 +31,97 @@ _FLAGS = {
 }
 
 
+class Match:
+    """a search result in `str` offsets
+
+    oniguruma works in utf-8 byte offsets which are converted on every call,
+    the tokenizer mostly wants the span of the whole match so that is
+    converted once up front.  `string` is the searched line itself rather
+    than the bytes decoded again
+    """
+    __slots__ = ('string', 'start', 'end', '_match')
+
+    def __init__(self, string: str, match: onigurumacffi._Match) -> None:
+        self.string = string
+        self.start, self.end = match.span()
+        self._match = match
+
+    def __repr__(self) -> str:
+        return (
+            f'<{type(self).__name__} span={(self.start, self.end)} '
+            f'match={self[0]!r}>'
+        )
+
+    def __getitem__(self, n: int) -> str:
+        return self._match[n]
+
+    def span(self, n: int) -> tuple[int, int]:
+        return self._match.span(n)
+
+
+def _wrap(line: str, match: onigurumacffi._Match | None) -> Match | None:
+    return None if match is None else Match(line, match)
+
+
+def _search_start(
+        prefilter: re.Pattern[str] | None,
+        line: str,
+        pos: int,
+) -> int:
+    """where a match could start at or after `pos` (-1: nowhere)"""
+    if prefilter is None:
+        return pos
+    candidate = prefilter.search(line, pos)
+    return -1 if candidate is None else candidate.start()
+
+
 class _Reg:
+    _NO_LAST = ('', -1, -1, None)
+
     def __init__(self, s: str) -> None:
         self._pattern = s
         self._reg = onigurumacffi.compile(self._pattern)
+        # a search result from an earlier `pos` is reused when its match is
+        # still at or after the new `pos` (leftmost matches can't change)
+        # -- except for \G which anchors to wherever the search starts
+        self._has_g = '\\G' in s
+        self._last: tuple[str, int, int, Match | None]
+        self._last = self._NO_LAST
 
     def __repr__(self) -> str:
         return f'{type(self).__name__}({self._pattern!r})'
 
+    @functools.cached_property
+    def _prefilter(self) -> re.Pattern[str] | None:
+        return make_prefilter((self._pattern,))
+
     def search(
             self,
             line: str,
             pos: int,
             first_line: bool,
             boundary: bool,
-    ) -> Match[str] | None:
-        return self._reg.search(line, pos, flags=_FLAGS[first_line, boundary])
+    ) -> Match | None:
+        flags = _FLAGS[first_line, boundary]
+        last_line, last_pos, last_flags, last_ret = self._last
+        if (
+                line is last_line and
+                last_flags == flags and
+                last_pos <= pos and
+                not (boundary and self._has_g) and
+                (last_ret is None or pos <= last_ret.start)
+        ):
+            return last_ret
+
+        start = _search_start(self._prefilter, line, pos)
+        if start == -1:
+            ret = None
+        else:
+            ret = _wrap(line, self._reg.search(line, start, flags=flags))
+        if self._last is self._NO_LAST:
+            _searched.append(self)
+        self._last = (line, pos, flags, ret)
+        return ret
 
     def match(
             self,
@@ -51,14 +129,30 @@ class _Reg:
             pos: int,
             first_line: bool,
             boundary: bool,
-    ) -> Match[str] | None:
-        return self._reg.match(line, pos, flags=_FLAGS[first_line, boundary])
+    ) -> Match | None:
+        flags = _FLAGS[first_line, boundary]
+        return _wrap(line, self._reg.match(line, pos, flags=flags))
 
 
 class _RegSet:
+    _NO_LAST = ('', -1, -1, (-1, None))
+
     def __init__(self, *s: str) -> None:
         self._patterns = s
-        self._set = onigurumacffi.compile_regset(*self._patterns)
+        # see `_Reg`
+        self._has_g = any('\\G' in pattern for pattern in s)
+        self._last: tuple[str, int, int, tuple[int, Match | None]]
+        self._last = self._NO_LAST
+
+    @functools.cached_property
+    def _set(self) -> onigurumacffi._RegSet:
+        # compiled on first search: many rules are entered (and immediately
+        # left) without their inner patterns ever being searched
+        return onigurumacffi.compile_regset(*self._patterns)
+
+    @functools.cached_property
+    def _prefilter(self) -> re.Pattern[str] | None:
+        return make_prefilter(self._patterns)
 
     def __repr__(self) -> str:
         args = ', '.join(repr(s) for s in self._patterns)
@@ -70,14 +164,119 @@ class _RegSet:
             pos: int,
             first_line: bool,
             boundary: bool,
-    ) -> tuple[int, Match[str] | None]:
-        return self._set.search(line, pos, flags=_FLAGS[first_line, boundary])
+    ) -> tuple[int, Match | None]:
+        flags = _FLAGS[first_line, boundary]
+        last_line, last_pos, last_flags, last_ret = self._last
+        if (
+                line is last_line and
+                last_flags == flags and
+                last_pos <= pos and
+                not (boundary and self._has_g) and
+                (last_ret[1] is None or pos <= last_ret[1].start)
+        ):
+            return last_ret
 
+        start = _search_start(self._prefilter, line, pos)
+        if start == -1:
+            ret: tuple[int, Match | None] = (-1, None)
+        else:
+            idx, match = self._set.search(line, start, flags=flags)
+            ret = (idx, _wrap(line, match))
+        if self._last is self._NO_LAST:
+            _searched.append(self)
+        self._last = (line, pos, flags, ret)
+        return ret
 
-def expand_escaped(match: Match[str], s: str) -> str:
+
+# regexes holding on to a search result, see `clear_searches`
+_searched: list[_Reg | _RegSet] = []
+
+
+def clear_searches() -> None:
+    """forget the search results kept for the line just tokenized
+
+    the compiled regexes are shared by every file, this keeps them from
+    holding on to the last (possibly very long) line searched
+    """
+    for reg in _searched:
+        reg._last = reg._NO_LAST
+    del _searched[:]
+
+
+def expand_escaped(match: Match, s: str) -> str:
     return _BACKREF_RE.sub(lambda m: f'{m[1]}{re.escape(match[int(m[2])])}', s)
 
 
+class CacheStats(NamedTuple):
+    hits: int
+    compiles: int
+    evictions: int
+    size: int
+
+
+class _LRURegs:
+    """backreference patterns compiled most recently, see `make_reg`"""
+
+    def __init__(self, maxsize: int) -> None:
+        self._maxsize = maxsize
+        self._regs: collections.OrderedDict[str, _Reg]
+        self._regs = collections.OrderedDict()
+        self._hits = self._compiles = self._evictions = 0
+
+    def __call__(self, s: str) -> _Reg:
+        try:
+            ret = self._regs[s]
+        except KeyError:
+            self._compiles += 1
+            ret = self._regs[s] = _Reg(s)
+            if len(self._regs) > self._maxsize:
+                self._regs.popitem(last=False)
+                self._evictions += 1
+        else:
+            self._hits += 1
+            self._regs.move_to_end(s)
+        return ret
+
+    def cache_clear(self) -> None:
+        self._regs.clear()
+        self._hits = self._compiles = self._evictions = 0
+
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self._hits,
+            compiles=self._compiles,
+            evictions=self._evictions,
+            size=len(self._regs),
+        )
+
+
+# patterns straight from grammars are bounded by the grammars in use and are
+# kept for good: states are hash-consed by their regexes' identity.  patterns
+# expanded from backreferences (heredocs, fences, ...) are as unbounded as
+# the documents being edited so only the most recent are kept
 make_reg = functools.cache(_Reg)
 make_regset = functools.cache(_RegSet)
+_make_backref_reg = _LRURegs(maxsize=256)
 ERR_REG = make_reg('$ ^')
+
+
+def make_backref_reg(match: Match, s: str) -> _Reg:
+    """compile `s` with its backreferences filled in from `match`"""
+    if _BACKREF_RE.search(s) is None:
+        return make_reg(s)
+    else:
+        return _make_backref_reg(expand_escaped(match, s))
+
+
+def cache_stats() -> dict[str, CacheStats]:
+    ret = {}
+    for name, func in (('reg', make_reg), ('regset', make_regset)):
+        info = func.cache_info()
+        ret[name] = CacheStats(
+            hits=info.hits,
+            compiles=info.misses,
+            evictions=0,
+            size=info.currsize,
+        )
+    ret['backref_reg'] = _make_backref_reg.stats()
+    return ret
@@ -33,6 +33,7 @@ from babi.proc import graceful_terminate
 from babi.prompt import Prompt
 from babi.prompt import PromptResult
 from babi.status import Status
+from babi.tokenizer import Tokenizer
 
 VERSION_STR = f'babi v{importlib.metadata.version("babi")}'
 
@@ -154,9 +155,13 @@ class Screen:
             stdscr: curses._CursesWindow,
             file_infos: list[FileInfo],
             perf: Perf,
+            tokenizer: Tokenizer | None = None,
     ) -> None:
         self.stdscr = stdscr
-        self.syntax = Syntax.from_screen(stdscr, ColorManager.make())
+        self.tokenizer = tokenizer
+        self.syntax = Syntax.from_screen(
+            stdscr, ColorManager.make(), tokenizer,
+        )
         self.files = [
             File(
                 info.filename,
@@ -297,6 +302,21 @@ class Screen:
         keyname = KEYNAME_REWRITE.get(keyname, keyname)
         return Key(wch, keyname)
 
+    def has_input(self) -> bool:
+        """check for a key without waiting for one"""
+        if self._buffered_input is not None or self._retheme:
+            return True
+
+        self.stdscr.nodelay(True)
+        try:
+            self._buffered_input = self.stdscr.get_wch()
+        except curses.error:
+            return False
+        else:
+            return True
+        finally:
+            self.stdscr.nodelay(False)
+
     def get_char(self) -> Key:
         self.perf.end()
         ret = self._get_char()
@@ -627,6 +647,20 @@ class Screen:
                     file.buf.set_tab_size(parsed_tab_size)
                 self.status.update('updated!')
 
+    def _command_highlightlimit(self, args: list[str]) -> None:
+        limit, = args
+        try:
+            parsed_limit = int(limit)
+        except ValueError:
+            self.status.update(f'invalid limit: {limit}')
+        else:
+            if parsed_limit <= 0:
+                self.status.update(f'invalid limit: {parsed_limit}')
+            else:
+                for file in self.files:
+                    file.set_highlight_limit(parsed_limit)
+                self.status.update('updated!')
+
     def _command_expandtabs(self, args: list[str]) -> None:
         for file in self.files:
             file.buf.expandtabs = True
@@ -662,7 +696,9 @@ class Screen:
         self.file.reload(self.status, self.layout.file)
 
     def _command_retheme(self, args: list[str]) -> None:
-        self.syntax = Syntax.from_screen(self.stdscr, ColorManager.make())
+        self.syntax = Syntax.from_screen(
+            self.stdscr, ColorManager.make(), self.tokenizer,
+        )
         for file in self.files:
             file.reload_theme(self.syntax)
 
@@ -677,6 +713,7 @@ class Screen:
         ':sort!': Command(_command_sort_bang),
         ':tabstop': Command(_command_tabsize, nargs=1),
         ':tabsize': Command(_command_tabsize, nargs=1),
+        ':highlightlimit': Command(_command_highlightlimit, nargs=1),
         ':expandtabs': Command(_command_expandtabs),
         ':noexpandtabs': Command(_command_noexpandtabs),
         ':comment': Command(_command_comment, nargs='?'),
@@ -1,14 +1,37 @@
 from __future__ import annotations
 
 import argparse
+import collections
+import contextlib
+import functools
+import itertools
+import multiprocessing
+import sys
+import time
+import weakref
+from collections.abc import Callable
+from collections.abc import Generator
+from collections.abc import Iterable
 from collections.abc import Sequence
+from typing import Any
 
 from babi.highlight import Compiler
+from babi.highlight import EndRule
 from babi.highlight import Grammars
 from babi.highlight import highlight_line
+from babi.highlight import highlight_lines
+from babi.highlight import MatchRule
+from babi.highlight import PatternRule
+from babi.highlight import Region
+from babi.highlight import Regions
+from babi.highlight import WhileRule
+from babi.reg import _Reg
+from babi.reg import _RegSet
+from babi.reg import cache_stats
 from babi.theme import Style
 from babi.theme import Theme
 from babi.user_data import prefix_data
+from babi.user_data import xdg_cache
 from babi.user_data import xdg_config
 
 
@@ -33,17 +56,230 @@ def print_styled(s: str, style: Style) -> None:
     print(f'{color_s}{s}{undo_s}', end='', flush=True)
 
 
-def _highlight_output(theme: Theme, compiler: Compiler, filename: str) -> int:
-    state = compiler.root_state
+def _highlighted(
+        compiler: Compiler,
+        filename: str,
+) -> Generator[tuple[str, Sequence[Region]]]:
+    with open(filename, encoding='UTF-8') as f:
+        lines, lines_hl = itertools.tee(f)
+        state = compiler.root_state
+        highlighted = highlight_lines(compiler, state, lines_hl, True)
+        for line, (_, regions) in zip(lines, highlighted):
+            yield line, regions
+
+
+# set in each worker process by `_init_worker`
+_worker_compiler: Compiler | None = None
+
+
+def _init_worker(grammar_dir: str, filename: str, first_line: str) -> None:
+    global _worker_compiler
+    grammars = Grammars(grammar_dir, cache_dir=xdg_cache('grammar_v1'))
+    _worker_compiler = grammars.compiler_for_file(filename, first_line)
+
+
+def _highlight_chunk(
+        args: tuple[list[str], bool],
+) -> list[tuple[Regions, bool]]:
+    lines, first_line = args
+    assert _worker_compiler is not None
+    compiler = _worker_compiler
+    return [
+        (tuple(regions), state is compiler.root_state)
+        for state, regions in highlight_lines(
+            compiler, compiler.root_state, lines, first_line,
+        )
+    ]
+
+
+def _highlighted_parallel(
+        compiler: Compiler,
+        filename: str,
+        grammar_dir: str,
+        jobs: int,
+) -> Generator[tuple[str, Sequence[Region]]]:
+    with open(filename, encoding='UTF-8') as f:
+        lines = f.readlines()
+    first_line = lines[0] if lines else ''
+
+    # several chunks per worker so that a chunk which has to be re-tokenized
+    # (see below) does not leave the other workers idle
+    chunk_size = max(1, -(-len(lines) // (jobs * 4)))
+    chunks = [
+        lines[i:i + chunk_size] for i in range(0, len(lines), chunk_size)
+    ]
+    root = compiler.root_state
+
+    initargs = (grammar_dir, filename, first_line)
+    with multiprocessing.Pool(jobs, _init_worker, initargs) as pool:
+        results = pool.imap(
+            _highlight_chunk,
+            [(chunk, i == 0) for i, chunk in enumerate(chunks)],
+        )
+
+        state = root
+        for chunk_idx, chunk_results in enumerate(results):
+            chunk = chunks[chunk_idx]
+
+            # each worker guesses that its chunk starts at the root state.
+            # until the real state and the worker's agree (both are at the
+            # root after the same line) the lines are re-tokenized here
+            synced = state is root
+            last_root = -1
+            for i, line in enumerate(chunk):
+                regions, at_root = chunk_results[i]
+                if not synced:
+                    state, regions = highlight_line(
+                        compiler, state, line, first_line=False,
+                    )
+                    synced = state is root and at_root
+                if synced and at_root:
+                    last_root = i
+                yield line, regions
+
+            if synced:
+                # the worker's end state is the real one, but it only told us
+                # when it was at the root -- recompute it from there
+                state = root
+                tail = chunk[last_root + 1:]
+                first = chunk_idx == 0 and last_root == -1
+                for state, _ in highlight_lines(compiler, root, tail, first):
+                    pass
+
+
+# regsets can have hundreds of patterns
+_NAME_WIDTH = 100
 
+
+class _Stat:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.matches = 0
+        self.time = 0.
+
+
+def _rule_key(rule: Any) -> str:
+    if rule.name:
+        return ' '.join(rule.name)
+    elif isinstance(rule, EndRule):
+        return f'end={rule.end!r}'
+    elif isinstance(rule, WhileRule):
+        return f'while={rule.while_!r}'
+    else:
+        return '(unnamed)'
+
+
+def _found(ret: object) -> bool:
+    return ret is not None
+
+
+def _regset_found(ret: tuple[int, object]) -> bool:
+    _, match = ret
+    return match is not None
+
+
+class _Profiler:
+    def __init__(self) -> None:
+        self.stats: collections.defaultdict[tuple[str, str], _Stat]
+        self.stats = collections.defaultdict(_Stat)
+        # rules recurse (through captures) so only the outermost call of
+        # each rule is timed to avoid counting the same time twice
+        self._active: collections.Counter[tuple[str, str]]
+        self._active = collections.Counter()
+        # a large regset's repr is slow to build, it is only made once
+        self._regex_keys: weakref.WeakKeyDictionary[_Reg | _RegSet, str]
+        self._regex_keys = weakref.WeakKeyDictionary()
+
+    def _regex_key(self, reg: _Reg | _RegSet) -> str:
+        try:
+            return self._regex_keys[reg]
+        except KeyError:
+            ret = self._regex_keys[reg] = repr(reg)
+            return ret
+
+    def _wrap(
+            self,
+            func: Callable[..., Any],
+            what: str,
+            key: Callable[[Any], str],
+            found: Callable[[Any], bool] | None,
+    ) -> Callable[..., Any]:
+        @functools.wraps(func)
+        def wrapped(obj: Any, *args: Any) -> Any:
+            k = (what, key(obj))
+            stat = self.stats[k]
+            self._active[k] += 1
+            t0 = time.perf_counter()
+            try:
+                ret = func(obj, *args)
+            finally:
+                self._active[k] -= 1
+                if not self._active[k]:
+                    stat.time += time.perf_counter() - t0
+            stat.calls += 1
+            if found is not None and found(ret):
+                stat.matches += 1
+            return ret
+        return wrapped
+
+    @contextlib.contextmanager
+    def enabled(self) -> Generator[None]:
+        targets: list[tuple[type[Any], str, Callable[[Any], str], Any]] = [
+            (_Reg, 'search', self._regex_key, _found),
+            (_RegSet, 'search', self._regex_key, _regset_found),
+        ]
+        for rule_cls in (PatternRule, MatchRule, EndRule, WhileRule):
+            for attr in ('start', 'search', 'continues'):
+                if attr in vars(rule_cls):
+                    found = None if attr == 'start' else _found
+                    targets.append((rule_cls, attr, _rule_key, found))
+
+        saved = []
+        for cls, attr, key, found in targets:
+            func = vars(cls)[attr]
+            saved.append((cls, attr, func))
+            what = f'{cls.__name__}.{attr}'
+            setattr(cls, attr, self._wrap(func, what, key, found))
+        try:
+            yield
+        finally:
+            for cls, attr, func in saved:
+                setattr(cls, attr, func)
+
+    def report(self) -> str:
+        # times are inclusive: a rule's search includes the searches and
+        # rules it delegates to
+        lines = [f'{"ms":>10} {"calls":>9} {"found":>6}  what']
+        by_time = sorted(self.stats.items(), key=lambda kv: -kv[1].time)
+        for (what, name), stat in by_time:
+            if what.endswith('.start'):
+                found_s = '-'
+            else:
+                found_s = f'{stat.matches / stat.calls:.0%}'
+            if len(name) > _NAME_WIDTH:
+                name = f'{name[:_NAME_WIDTH - 3]}...'
+            lines.append(
+                f'{stat.time * 1000:10.1f} {stat.calls:9} {found_s:>6}  '
+                f'{what} {name}',
+            )
+        lines.append('')
+        for name, cache in cache_stats().items():
+            lines.append(
+                f'{name} cache: {cache.hits} hits, '
+                f'{cache.compiles} compiles, {cache.evictions} evictions',
+            )
+        return '\n'.join(lines)
+
+
+def _highlight_output(
+        theme: Theme,
+        highlighted: Iterable[tuple[str, Sequence[Region]]],
+) -> int:
     if theme.default.bg is not None:
         print('\x1b[48;2;{r};{g};{b}m'.format(**theme.default.bg._asdict()))
-    with open(filename, encoding='UTF-8') as f:
-        for line_idx, line in enumerate(f):
-            first_line = line_idx == 0
-            state, regions = highlight_line(compiler, state, line, first_line)
-            for start, end, scope in regions:
-                print_styled(line[start:end], theme.select(scope))
+    for line, regions in highlighted:
+        for start, end, scope in regions:
+            print_styled(line[start:end], theme.select(scope))
     print('\x1b[m', end='')
     return 0
 
@@ -52,6 +288,14 @@ def main(argv: Sequence[str] | None = None) -> int:
     parser = argparse.ArgumentParser()
     parser.add_argument('--theme', default=xdg_config('theme.json'))
     parser.add_argument('--grammar-dir', default=prefix_data('grammar_v1'))
+    parser.add_argument(
+        '--jobs', type=int, default=1,
+        help='tokenize using this many worker processes',
+    )
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='print time spent per grammar rule / regex to stderr',
+    )
     parser.add_argument('filename')
     args = parser.parse_args(argv)
 
@@ -60,10 +304,24 @@ def main(argv: Sequence[str] | None = None) -> int:
 
     theme = Theme.from_filename(args.theme)
 
-    grammars = Grammars(args.grammar_dir)
+    grammars = Grammars(args.grammar_dir, cache_dir=xdg_cache('grammar_v1'))
     compiler = grammars.compiler_for_file(args.filename, first_line)
 
-    return _highlight_output(theme, compiler, args.filename)
+    if args.profile:
+        profiler = _Profiler()
+        with profiler.enabled():
+            ret = _highlight_output(
+                theme, _highlighted(compiler, args.filename),
+            )
+        print(profiler.report(), file=sys.stderr)
+        return ret
+    elif args.jobs > 1:
+        highlighted = _highlighted_parallel(
+            compiler, args.filename, args.grammar_dir, args.jobs,
+        )
+    else:
+        highlighted = _highlighted(compiler, args.filename)
+    return _highlight_output(theme, highlighted)
 
 
 if __name__ == '__main__':
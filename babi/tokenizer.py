@@ -0,0 +1,251 @@
+"""tokenize lines in a worker process
+
+the worker loads the grammars and keeps the states, lines are sent over a
+pipe a batch at a time and the scopes of each line are sent back -- the
+theme stays in the editor which styles them
+
+the same few scopes come up over and over so each is numbered the first time
+it is seen, tokens refer to it by that number and the editor is sent the new
+scopes along with each batch
+"""
+from __future__ import annotations
+
+import contextlib
+import functools
+import itertools
+import multiprocessing
+from collections.abc import Callable
+from collections.abc import Generator
+from multiprocessing.connection import Connection
+from typing import NamedTuple
+
+from babi.highlight import Compiler
+from babi.highlight import Grammars
+from babi.highlight import highlight_line_into
+from babi.highlight import Region
+from babi.highlight import Scope
+from babi.highlight import State
+
+# seconds to wait for the worker to exit before it is terminated
+_JOIN_TIMEOUT = 1
+
+# (start, end, scope number)
+Tokens = tuple[tuple[int, int, int], ...]
+
+
+class _Request(NamedTuple):
+    doc: int
+    filename: str | None
+    first_line: str
+    start: int
+    lines: tuple[str, ...]
+    highlight_limit: int
+    forget: tuple[int, ...]
+
+
+class _Sent(NamedTuple):
+    doc: int
+    generation: int
+    start: int
+
+
+class _Batch(NamedTuple):
+    new_scopes: list[Scope]
+    tokens: list[Tokens]
+
+
+class Tokenized(NamedTuple):
+    doc: int
+    generation: int
+    start: int
+    tokens: list[Tokens]
+
+
+class _ScopeIds(dict[Scope, int]):
+    def __init__(self) -> None:
+        super().__init__()
+        self.new: list[Scope] = []
+
+    def __missing__(self, scope: Scope) -> int:
+        ret = self[scope] = len(self)
+        self.new.append(scope)
+        return ret
+
+
+class _Doc(NamedTuple):
+    compiler: Compiler
+    states: list[State]
+    tokenize: Callable[[State, str, bool], tuple[State, Tokens]]
+
+
+def _tokenize_line(
+        compiler: Compiler,
+        scope_ids: _ScopeIds,
+        state: State,
+        line: str,
+        first_line: bool,
+) -> tuple[State, Tokens]:
+    regions: list[Region] = []
+    state = highlight_line_into(
+        compiler, state, f'{line}\n', first_line, regions,
+    )
+    return state, tuple((r.start, r.end, scope_ids[r.scope]) for r in regions)
+
+
+def _tokenize(doc: _Doc, request: _Request) -> list[Tokens]:
+    # anything after the first line sent is from an older version
+    del doc.states[request.start:]
+    if doc.states:
+        state = doc.states[-1]
+    else:
+        state = doc.compiler.root_state
+
+    ret = []
+    for i, line in enumerate(request.lines, request.start):
+        if len(line) > request.highlight_limit:
+            tokens: Tokens = ()
+        else:
+            state, tokens = doc.tokenize(state, line, i == 0)
+        doc.states.append(state)
+        ret.append(tokens)
+    return ret
+
+
+def _serve(conn: Connection, make_grammars: Callable[[], Grammars]) -> None:
+    docs: dict[int, _Doc] = {}
+    scope_ids = _ScopeIds()
+    # the editor has gone away when the pipe closes
+    with contextlib.suppress(EOFError, ConnectionError):
+        while True:
+            request: _Request = conn.recv()
+            for doc_id in request.forget:
+                docs.pop(doc_id, None)
+
+            try:
+                doc = docs[request.doc]
+            except KeyError:
+                # picked the same way the editor picked it
+                grammars = make_grammars()
+                if request.filename is None:
+                    compiler = grammars.blank_compiler()
+                else:
+                    compiler = grammars.compiler_for_file(
+                        request.filename, request.first_line,
+                    )
+                tokenize = functools.partial(
+                    _tokenize_line, compiler, scope_ids,
+                )
+                doc = docs[request.doc] = _Doc(
+                    compiler=compiler,
+                    states=[],
+                    tokenize=functools.lru_cache(maxsize=4096)(tokenize),
+                )
+
+            tokens = _tokenize(doc, request)
+            conn.send(_Batch(scope_ids.new, tokens))
+            scope_ids.new = []
+
+
+class Tokenizer:
+    """the editor's end of the pipe
+
+    only one batch is in flight at a time so neither end can block writing
+    while the other one is, results for other files are kept until asked for
+
+    if the worker goes away the tokenizer is marked `dead` and the files are
+    highlighted in the editor instead
+    """
+
+    def __init__(self, conn: Connection) -> None:
+        self._conn = conn
+        self.dead = False
+        # indexed by the scope numbers in the tokens
+        self.scopes: list[Scope] = []
+        self._doc_ids = itertools.count()
+        self._sent: _Sent | None = None
+        self._done: dict[int, Tokenized] = {}
+        self._forget: list[int] = []
+
+    def new_doc(self) -> int:
+        return next(self._doc_ids)
+
+    def forget(self, doc: int) -> None:
+        self._forget.append(doc)
+
+    def _poll(self, timeout: float) -> None:
+        # receive the batch in flight if it is done within `timeout`
+        assert self._sent is not None
+        try:
+            if not self._conn.poll(timeout):
+                return
+            batch: _Batch = self._conn.recv()
+        except (EOFError, OSError):
+            self.dead = True
+            return
+
+        sent, self._sent = self._sent, None
+        self.scopes.extend(batch.new_scopes)
+        self._done[sent.doc] = Tokenized(*sent, batch.tokens)
+
+    def send(
+            self,
+            doc: int,
+            generation: int,
+            filename: str | None,
+            first_line: str,
+            start: int,
+            lines: tuple[str, ...],
+            highlight_limit: int,
+            timeout: float,
+    ) -> bool:
+        """send a batch (False if another is in flight after `timeout`)"""
+        if self._sent is not None:
+            self._poll(timeout)
+        if self.dead or self._sent is not None:
+            return False
+
+        for forgotten in self._forget:
+            self._done.pop(forgotten, None)
+        forget, self._forget = tuple(self._forget), []
+
+        request = _Request(
+            doc, filename, first_line, start, lines, highlight_limit, forget,
+        )
+        try:
+            self._conn.send(request)
+        except OSError:
+            self.dead = True
+            return False
+        self._sent = _Sent(doc, generation, start)
+        return True
+
+    def result(self, doc: int, timeout: float) -> Tokenized | None:
+        """the batch sent for `doc` (None if it is not done in time)"""
+        if doc not in self._done and self._sent is not None:
+            self._poll(timeout)
+        return self._done.pop(doc, None)
+
+
+@contextlib.contextmanager
+def tokenizer_process(
+        *directories: str,
+        cache_dir: str | None = None,
+) -> Generator[Tokenizer]:
+    # spawned rather than forked: the editor already owns the terminal
+    ctx = multiprocessing.get_context('spawn')
+    conn, child_conn = ctx.Pipe()
+    make_grammars = functools.partial(
+        Grammars.shared, *directories, cache_dir=cache_dir,
+    )
+    proc = ctx.Process(target=_serve, args=(child_conn, make_grammars))
+    proc.start()
+    child_conn.close()
+    try:
+        yield Tokenizer(conn)
+    finally:
+        # the worker exits when the pipe closes, unless it is stuck in a batch
+        conn.close()
+        proc.join(timeout=_JOIN_TIMEOUT)
+        if proc.is_alive():
+            proc.terminate()
+            proc.join()
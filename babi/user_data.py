@@ -19,5 +19,9 @@ def xdg_config(*path: str) -> str:
     return _xdg(*path, env='XDG_CONFIG_HOME', default='~/.config')
 
 
+def xdg_cache(*path: str) -> str:
+    return _xdg(*path, env='XDG_CACHE_HOME', default='~/.cache')
+
+
 def prefix_data(*path: str) -> str:
     return os.path.join(sys.prefix, 'share/babi', *path)
@@ -0,0 +1,389 @@
+"""benchmark highlighting throughput on a synthetic corpus
+
+usage: python -m testing.bench [--output results.json] [--compare old.json]
+"""
+from __future__ import annotations
+
+import argparse
+import importlib.metadata
+import json
+import os.path
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from collections.abc import Sequence
+from typing import Any
+
+from babi.buf import Buf
+from babi.color_manager import ColorManager
+from babi.highlight import Grammars
+from babi.highlight import highlight_line
+from babi.hl.syntax import BaseFileSyntax
+from babi.hl.syntax import Syntax
+from babi.reg import _make_backref_reg
+from babi.reg import make_reg
+from babi.reg import make_regset
+from babi.theme import Theme
+from babi.user_data import prefix_data
+
+PY = '''\
+@functools.cache
+def func_{i}(x: int, *args: str, y: bool = True) -> dict[str, int]:
+    """docstring for func_{i}"""
+    s = f'{{x!r}} {i} {{y:>10}}'  # a comment
+    if x > 0x{i:x} and not y:
+        return {{'k{i}': x * {i}.5, **kwargs}}
+    return [n for n in range({i}) if n % 2]
+
+
+class C{i}(Base):
+    attr: ClassVar[int] = {i}
+
+'''
+
+JS = '''\
+export async function f{i}(a, b = {i}, ...rest) {{
+    const re = /ab+c{i}/gi;  // a comment
+    let s = `template ${{a + b}} {i}`;
+    /* block
+       comment */
+    return rest.map((x) => x * {i}.5).filter(Boolean);
+}}
+'''
+
+MD = '''\
+# heading {i}
+
+some *emphasis* and **strong** text with `code` and a [link](#{i}).
+
+- item {i}
+  - nested _item_
+
+```python
+def f{i}(x):
+    return x + {i}
+```
+
+```js
+const x{i} = {{a: [1, 2, {i}]}};
+```
+
+'''
+
+YAML = '''\
+key{i}: &anchor{i}
+  nested: "string {i}"  # comment
+  list:
+    - {i}
+    - true
+    - ~
+  block: |
+    text {i}
+other{i}: *anchor{i}
+'''
+
+C = '''\
+#include <stdio.h>
+#define MAX_{i} ({i} * 2)
+
+/* block comment {i} */
+static int f{i}(const char *s, struct thing *t) {{
+    for (int n = 0; n < MAX_{i}; n++) {{  // a comment
+        printf("%s %d\\n", s, t->v[n] + {i});
+    }}
+    return 0x{i:x};
+}}
+
+'''
+
+JSON_ITEM = '''\
+    {{
+        "id": {i},
+        "name": "item {i}",
+        "tags": ["a", "b", null, true],
+        "value": {i}.5e-3
+    }}'''
+
+MINIFIED_ITEM = (
+    'function f{i}(a,b){{var c="s{i}",d=/x{i}/g;'
+    'return a?b.map(function(e){{return e+{i}}}):c.replace(d,"")}}'
+)
+
+
+def _repeat(template: str, lines: int) -> str:
+    ret = []
+    n = 0
+    i = 0
+    while n < lines:
+        s = template.format(i=i)
+        ret.append(s)
+        n += s.count('\n')
+        i += 1
+    return ''.join(ret)
+
+
+def _json(lines: int) -> str:
+    items = [JSON_ITEM.format(i=i) for i in range(max(1, lines // 7))]
+    return '[\n' + ',\n'.join(items) + '\n]\n'
+
+
+def _minified(lines: int) -> str:
+    # a handful of very long lines
+    items = [MINIFIED_ITEM.format(i=i) for i in range(max(1, lines // 10))]
+    per_line = 50
+    return ''.join(
+        ';'.join(items[i:i + per_line]) + '\n'
+        for i in range(0, len(items), per_line)
+    )
+
+
+def _nested(lines: int) -> str:
+    depth = 50
+    items = []
+    for i in range(max(1, lines // (depth * 2))):
+        opening = [f'{"  " * d}{{"k{i}_{d}": [\n' for d in range(depth)]
+        closing = [f'{"  " * d}]}}\n' for d in reversed(range(depth))]
+        items.append(''.join(opening + closing).rstrip('\n'))
+    return '[\n' + ',\n'.join(items) + '\n]\n'
+
+
+def _blockquote(lines: int) -> str:
+    # every line continues a deep stack of while rules (> and list items)
+    depth = 8
+    ret = []
+    for i in range(lines):
+        quote = '> ' * (1 + i % depth)
+        ret.append(f'{quote}- item {i} with *emphasis* and `code`\n')
+    return ''.join(ret)
+
+
+THEME = Theme.from_dct({})
+
+CORPUS: dict[str, Callable[[int], str]] = {
+    'python.py': lambda n: _repeat(PY, n),
+    'javascript.js': lambda n: _repeat(JS, n),
+    'markdown.md': lambda n: _repeat(MD, n),
+    'yaml.yaml': lambda n: _repeat(YAML, n),
+    'c.c': lambda n: _repeat(C, n),
+    'json.json': _json,
+    'minified.js': _minified,
+    'nested.json': _nested,
+    'blockquote.md': _blockquote,
+}
+
+
+def _clear_regex_caches() -> None:
+    make_reg.cache_clear()
+    make_regset.cache_clear()
+    _make_backref_reg.cache_clear()
+
+
+def _time_highlight_line(
+        grammar_dir: str,
+        filename: str,
+        lines: list[str],
+        repeat: int,
+) -> tuple[float, float]:
+    def run() -> float:
+        t0 = time.perf_counter()
+        state = compiler.root_state
+        for i, line in enumerate(lines):
+            state, _ = highlight_line(compiler, state, line, i == 0)
+        return time.perf_counter() - t0
+
+    # cold: nothing loaded, nothing compiled
+    _clear_regex_caches()
+    t0 = time.perf_counter()
+    grammars = Grammars(grammar_dir)
+    compiler = grammars.compiler_for_file(filename, lines[0])
+    cold = time.perf_counter() - t0 + run()
+
+    warm = min(run() for _ in range(repeat))
+    return cold, warm
+
+
+def _highlight_all(file_hl: BaseFileSyntax, buf: Buf) -> None:
+    # highlighting is time sliced per frame, keep going until it is done
+    while True:
+        file_hl.highlight_until(buf, len(buf))
+        if not file_hl.pending:
+            break
+
+
+def _time_file_syntax(
+        grammar_dir: str,
+        filename: str,
+        lines: list[str],
+        repeat: int,
+) -> tuple[float, float]:
+    # there is no terminal to turn styles into curses attributes so every
+    # scope is selected from an (empty) theme but never styled
+    syntax = Syntax(Grammars(grammar_dir), THEME, ColorManager.make())
+    buf = Buf([line.rstrip('\n') for line in lines])
+
+    _clear_regex_caches()
+    t0 = time.perf_counter()
+    file_hl = syntax.file_highlighter(filename, buf[0])
+    file_hl.register_callbacks(buf)
+    _highlight_all(file_hl, buf)
+    cold = time.perf_counter() - t0
+
+    # warm: an edit to the first line invalidates everything after it but
+    # the tokenized lines are still cached
+    warm = float('inf')
+    for _ in range(repeat):
+        buf[0] = buf[0]
+        t0 = time.perf_counter()
+        _highlight_all(file_hl, buf)
+        warm = min(warm, time.perf_counter() - t0)
+    return cold, warm
+
+
+def _time_vsc(vsc_js: str, grammar: str, filename: str) -> float:
+    # includes node startup and printing the tokens
+    t0 = time.perf_counter()
+    subprocess.run(
+        ('node', vsc_js, grammar, filename),
+        check=True, stdout=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - t0
+
+
+def _per_line(n_lines: int, cold: float, warm: float) -> dict[str, float]:
+    return {
+        'cold_us_per_line': cold / n_lines * 1e6,
+        'warm_us_per_line': warm / n_lines * 1e6,
+        'warm_lines_per_sec': n_lines / warm,
+    }
+
+
+def _bench_file(
+        path: str,
+        *,
+        grammar_dir: str,
+        repeat: int,
+        vsc_js: str | None,
+) -> dict[str, Any]:
+    with open(path, encoding='UTF-8') as f:
+        lines = f.readlines()
+
+    grammars = Grammars(grammar_dir)
+    scope = grammars.compiler_for_file(path, lines[0]).root_scope
+
+    hl_cold, hl_warm = _time_highlight_line(grammar_dir, path, lines, repeat)
+    fs_cold, fs_warm = _time_file_syntax(grammar_dir, path, lines, repeat)
+    ret = {
+        'name': os.path.basename(path),
+        'scope': scope,
+        'lines': len(lines),
+        'chars': sum(len(line) for line in lines),
+        'highlight_line': _per_line(len(lines), hl_cold, hl_warm),
+        'file_syntax': _per_line(len(lines), fs_cold, fs_warm),
+    }
+
+    grammar = os.path.join(grammar_dir, f'{scope}.json')
+    if vsc_js is not None and os.path.exists(grammar):
+        vsc = _time_vsc(vsc_js, grammar, path)
+        ret['vsc'] = {'us_per_line': vsc / len(lines) * 1e6}
+
+    return ret
+
+
+def _summary(results: list[dict[str, Any]]) -> str:
+    lines = [
+        f'{"file":<16}{"lines":>7}  '
+        f'{"hl cold":>9}{"hl warm":>9}{"fs cold":>9}{"fs warm":>9}'
+        f'{"vsc":>9}  (us/line)',
+    ]
+    for result in results:
+        cols = [
+            result['highlight_line']['cold_us_per_line'],
+            result['highlight_line']['warm_us_per_line'],
+            result['file_syntax']['cold_us_per_line'],
+            result['file_syntax']['warm_us_per_line'],
+        ]
+        vsc = result.get('vsc', {}).get('us_per_line')
+        vsc_s = f'{vsc:9.1f}' if vsc is not None else f'{"-":>9}'
+        lines.append(
+            f'{result["name"]:<16}{result["lines"]:>7}  '
+            f'{"".join(f"{col:9.1f}" for col in cols)}{vsc_s}',
+        )
+    return '\n'.join(lines)
+
+
+def _compare(old: dict[str, Any], new: dict[str, Any]) -> str:
+    old_by_name = {result['name']: result for result in old['results']}
+    lines = [f'compared to babi {old["babi"]} (new / old, warm):']
+    for result in new['results']:
+        prev = old_by_name.get(result['name'])
+        if prev is None:
+            continue
+        ratios = []
+        for kind in ('highlight_line', 'file_syntax'):
+            before = prev[kind]['warm_us_per_line']
+            after = result[kind]['warm_us_per_line']
+            ratios.append(f'{kind} {after / before:.2f}x')
+        lines.append(f'{result["name"]:<16}{", ".join(ratios)}')
+    return '\n'.join(lines)
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--grammar-dir', default=prefix_data('grammar_v1'))
+    parser.add_argument(
+        '--lines', type=int, default=1000,
+        help='approximate size of each generated file (default %(default)s)',
+    )
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument(
+        '--vsc', metavar='VSC_JS',
+        help='also time testing/vsc_test/vsc.js (needs `npm install`)',
+    )
+    parser.add_argument('--output', help='write the results as json')
+    parser.add_argument('--compare', help='a previous --output to compare')
+    parser.add_argument(
+        'files', nargs='*',
+        help='benchmark these files as well as the generated corpus',
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = []
+        for name, make in CORPUS.items():
+            path = os.path.join(tmpdir, name)
+            with open(path, 'w', encoding='UTF-8') as f:
+                f.write(make(args.lines))
+            paths.append(path)
+        paths.extend(args.files)
+
+        results = [
+            _bench_file(
+                path,
+                grammar_dir=args.grammar_dir,
+                repeat=args.repeat,
+                vsc_js=args.vsc,
+            )
+            for path in paths
+        ]
+
+    out = {
+        'babi': importlib.metadata.version('babi'),
+        'python': platform.python_version(),
+        'results': results,
+    }
+    print(_summary(results), file=sys.stderr)
+    if args.compare:
+        with open(args.compare, encoding='UTF-8') as f:
+            print(_compare(json.load(f), out), file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as f:
+            json.dump(out, f, indent=2)
+            f.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
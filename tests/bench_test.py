@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import json
+from unittest import mock
+
+from testing import bench
+
+
+def test_corpus_is_valid_json():
+    json.loads(bench._json(50))
+    json.loads(bench._nested(200))
+
+
+def test_bench(tmpdir, capsys):
+    extra = tmpdir.join('extra.unknown-extension')
+    extra.write('hello\nworld\n')
+    output = tmpdir.join('out.json')
+
+    with mock.patch.object(bench.subprocess, 'run') as run:
+        assert not bench.main((
+            '--lines', '20', '--repeat', '1',
+            '--vsc', 'vsc.js',
+            '--output', str(output),
+            str(extra),
+        ))
+
+    results = json.loads(output.read())['results']
+    by_name = {result['name']: result for result in results}
+    assert set(by_name) == {*bench.CORPUS, 'extra.unknown-extension'}
+    assert by_name['python.py']['scope'] == 'source.python'
+    assert by_name['python.py']['highlight_line']['warm_us_per_line'] > 0
+    assert by_name['python.py']['file_syntax']['cold_us_per_line'] > 0
+    # no grammar file to hand to vscode-textmate
+    assert 'vsc' not in by_name['extra.unknown-extension']
+    assert 'vsc' in by_name['python.py']
+    assert run.call_count == len(bench.CORPUS)
+
+    _, err = capsys.readouterr()
+    assert err.startswith('file ')
+    assert 'python.py' in err
+
+    new = tmpdir.join('new.unknown-extension')
+    new.write('hello\n')
+    assert not bench.main((
+        '--lines', '20', '--repeat', '1', '--compare', str(output), str(new),
+    ))
+    _, err = capsys.readouterr()
+    _, compared = err.split('compared to babi ')
+    assert 'python.py       highlight_line ' in compared
+    # not in the previous results
+    assert 'new.unknown-extension' not in compared
@@ -1,19 +1,57 @@
 from __future__ import annotations
 
 import json
+import multiprocessing
+import os
+import threading
+from unittest import mock
 
 import pytest
 
 from babi.highlight import Grammars
+from babi.tokenizer import _serve
+from babi.tokenizer import Tokenizer
+
+
+@pytest.fixture(autouse=True)
+def xdg_cache_home(tmpdir):
+    cache_home = tmpdir.join('cache_home')
+    with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': str(cache_home)}):
+        yield cache_home
 
 
 @pytest.fixture
 def make_grammars(tmpdir):
     grammar_dir = tmpdir.join('grammars').ensure_dir()
 
-    def make_grammars(*grammar_dcts):
+    def make_grammars(*grammar_dcts, cache_dir=None):
         for grammar in grammar_dcts:
             filename = f'{grammar["scopeName"]}.json'
             grammar_dir.join(filename).write(json.dumps(grammar))
-        return Grammars(grammar_dir)
+        return Grammars(grammar_dir, cache_dir=cache_dir)
     return make_grammars
+
+
+TOKENIZER_DEMO = {
+    'scopeName': 'source.demo',
+    'fileTypes': ['demo'],
+    'patterns': [
+        {'match': 'int', 'name': 'keyword'},
+        {'begin': '"', 'end': '"', 'name': 'string'},
+    ],
+}
+
+
+@pytest.fixture
+def tokenizer_worker(make_grammars):
+    # the worker runs on a thread, started by the test
+    grammars = make_grammars(TOKENIZER_DEMO)
+    conn, child_conn = multiprocessing.Pipe()
+    thread = threading.Thread(
+        target=_serve, args=(child_conn, lambda: grammars),
+    )
+    try:
+        yield grammars, Tokenizer(conn), thread.start
+    finally:
+        conn.close()
+        thread.join()
@@ -11,6 +11,7 @@ from unittest import mock
 
 import pytest
 
+from babi.hl import syntax
 from babi.main import main
 from babi.screen import VERSION_STR
 from testing.runner import PrintsErrorRunner
@@ -37,6 +38,14 @@ def xdg_config_home(tmpdir):
         yield config_home
 
 
+@pytest.fixture(autouse=True)
+def highlight_whole_frame():
+    # each frame is highlighted in full so screens don't depend on timing,
+    # tests of the incremental highlighting lower this
+    with mock.patch.object(syntax, '_BUDGET', 30):
+        yield
+
+
 @pytest.fixture
 def ten_lines(tmpdir):
     f = tmpdir.join('f')
@@ -385,6 +394,10 @@ class DeferredRunner:
                     self._ops.append(op)
         self._ops.append(CursesError())
 
+    def idle(self):
+        """no key is pressed (when babi checks without waiting)"""
+        self._ops.append(CursesError())
+
     def answer_no_if_modified(self):
         self.press('n')
 
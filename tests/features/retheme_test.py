@@ -170,3 +170,30 @@ def test_retheme_bug(run, xdg_config_home, tmpdir):
                 c_minus * 7 + c_base * 73,            # - world
         ]):
             h.assert_screen_attr_equal(i, attr)
+
+
+def test_retheme_reloads_modified_grammar(run, demo, xdg_data_home):
+    def hot_modify_grammar():
+        new_syntax = SYNTAX.replace('"comment"', '"not-a-comment"')
+        xdg_data_home.join('babi/grammar_v1/demo.json').write(new_syntax)
+
+    with run(str(demo), term='screen-256color', width=40) as h, and_exit(h):
+        h.await_text('hello world')
+
+        for i, attr in enumerate([
+                [(236, 40, curses.A_REVERSE)] * 40,         # header
+                [(160, 40, 0)] * 13 + [(236, 40, 0)] * 27,  # # hello world
+        ]):
+            h.assert_screen_attr_equal(i, attr)
+
+        h.run(hot_modify_grammar)
+
+        trigger_command_mode(h)
+        h.press_and_enter(':retheme')
+        h.await_text_missing(':retheme')
+
+        for i, attr in enumerate([
+                [(236, 40, curses.A_REVERSE)] * 40,  # header
+                [(236, 40, 0)] * 40,                 # # hello world
+        ]):
+            h.assert_screen_attr_equal(i, attr)
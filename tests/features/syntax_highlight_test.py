@@ -2,10 +2,14 @@ from __future__ import annotations
 
 import curses
 import json
+from multiprocessing.connection import Connection
+from unittest import mock
 
 import pytest
 
+from babi.hl import syntax
 from testing.runner import and_exit
+from testing.runner import trigger_command_mode
 
 
 THEME = json.dumps({
@@ -72,6 +76,72 @@ def test_syntax_highlighting(run, demo):
             h.assert_screen_attr_equal(i, attr)
 
 
+def test_syntax_highlighting_tokenizer_process(run_only_fake, demo):
+    with run_only_fake(
+            str(demo), '--tokenizer-process', term='screen-256color', width=20,
+    ) as h, and_exit(h):
+        h.await_text('still more')
+        for i, attr in enumerate([
+                [(236, 40, curses.A_REVERSE)] * 20,        # header
+                [(52, 203, 0)] * 5 + [(236, 40, 0)] * 15,  # - foo
+                [(243, 40, 0)] * 14 + [(236, 40, 0)] * 6,  # # comment here
+                [(236, 40, 0)] * 20,                       # uncolored
+                [(17, 40, 0)] * 7 + [(236, 40, 0)] * 13,   # """tqs!
+        ]):
+            h.assert_screen_attr_equal(i, attr)
+
+
+def test_syntax_highlighting_tokenizer_process_died(run_only_fake, demo):
+    with mock.patch.object(Connection, 'recv', side_effect=EOFError):
+        with run_only_fake(
+                str(demo), '--tokenizer-process',
+                term='screen-256color', width=20,
+        ) as h, and_exit(h):
+            h.await_text('still more')
+            h.idle()
+            # highlighted in the editor instead
+            attr = [(52, 203, 0)] * 5 + [(236, 40, 0)] * 15
+            h.assert_screen_attr_equal(1, attr)
+
+
+@pytest.fixture
+def one_line_per_frame():
+    with mock.patch.object(syntax, '_BUDGET', -1):
+        yield
+
+
+def test_syntax_highlighting_finished_while_idle(
+        run_only_fake,
+        demo,
+        one_line_per_frame,
+):
+    with run_only_fake(str(demo), term='screen-256color', width=20) as h:
+        with and_exit(h):
+            h.await_text('still more')
+            for _ in range(10):
+                h.idle()
+            attr = [(17, 40, 0)] * 3 + [(236, 40, 0)] * 17
+            h.assert_screen_attr_equal(6, attr)
+
+
+def test_syntax_highlighting_interrupted_by_keys(
+        run_only_fake,
+        demo,
+        one_line_per_frame,
+):
+    with run_only_fake(str(demo), term='screen-256color', width=20) as h:
+        with and_exit(h):
+            # the enter is buffered while reading the string
+            h.press_sequence('a', 'Enter')
+            h.await_cursor_position(x=0, y=2)
+            for _ in range(10):
+                h.idle()
+            attr = [(52, 203, 0)] * 5 + [(236, 40, 0)] * 15
+            h.assert_screen_attr_equal(2, attr)
+            attr = [(17, 40, 0)] * 3 + [(236, 40, 0)] * 17
+            h.assert_screen_attr_equal(7, attr)
+
+
 def test_syntax_highlighting_does_not_highlight_arrows(run, tmpdir):
     f = tmpdir.join('f')
     f.write(
@@ -160,3 +230,48 @@ def test_syntax_highlighting_tabs_after_line_creation(run, tmpdir):
 def test_does_not_crash_with_no_color_support(run):
     with run(term='xterm-mono') as h, and_exit(h):
         pass
+
+
+def test_syntax_highlighting_limit(run, tmpdir):
+    f = tmpdir.join('f.demo')
+    f.write('# short\n# much longer\n')
+
+    with run(str(f), term='screen-256color', width=20) as h, and_exit(h):
+        h.await_text('much longer')
+        trigger_command_mode(h)
+        h.press_and_enter(':highlightlimit 10')
+        h.await_text('updated!')
+        for i, attr in enumerate([
+                [(236, 40, curses.A_REVERSE)] * 20,        # header
+                [(243, 40, 0)] * 7 + [(236, 40, 0)] * 13,  # # short
+                # not highlighted: dimmed
+                [(236, 40, curses.A_DIM)] * 13 + [(236, 40, 0)] * 7,
+        ]):
+            h.assert_screen_attr_equal(i, attr)
+
+
+def test_syntax_highlighting_limit_reported_on_open(run, tmpdir):
+    f = tmpdir.join('f.demo')
+    f.write(f'# {"x" * 20000}\n')
+
+    with run(str(f)) as h, and_exit(h):
+        h.await_text('lines longer than 20000 characters are not highlighted')
+
+
+def test_syntax_highlighting_limit_reported_with_mixed_newlines(run, tmpdir):
+    f = tmpdir.join('f.demo')
+    f.write_binary(f'# {"x" * 20000}\r\n# short\n'.encode())
+
+    with run(str(f), width=120) as h, and_exit(h):
+        h.await_text(
+            'lines longer than 20000 characters are not highlighted; '
+            r"mixed newlines will be converted to '\n'",
+        )
+
+
+@pytest.mark.parametrize('limit', ('-1', '0', 'wat'))
+def test_syntax_highlighting_invalid_limit(run, tmpdir, limit):
+    with run() as h, and_exit(h):
+        trigger_command_mode(h)
+        h.press_and_enter(f':highlightlimit {limit}')
+        h.await_text(f'invalid limit: {limit}')
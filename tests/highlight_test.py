@@ -1,11 +1,23 @@
 from __future__ import annotations
 
+import json
+import pickle
 import stat
+from typing import Any
+from unittest import mock
 
 import pytest
 
+from babi import highlight
+from babi import reg
+from babi.highlight import _InternTable
+from babi.highlight import _ScopeNode
+from babi.highlight import Grammar
+from babi.highlight import Grammars
 from babi.highlight import highlight_line
+from babi.highlight import highlight_lines
 from babi.highlight import Region
+from babi.highlight import Rule
 
 
 def test_grammar_matches_extension_only_name(make_grammars):
@@ -32,6 +44,186 @@ def test_grammar_matches_via_identify_tag(make_grammars):
     assert compiler.root_state.entries[0].scope[0] == 'source.ini'
 
 
+def test_grammar_repository_is_lazy(make_grammars):
+    grammars = make_grammars({
+        'scopeName': 'test',
+        'patterns': [{'include': '#used'}],
+        'repository': {
+            'used': {
+                'begin': 'a',
+                'end': 'b',
+                'patterns': [{'include': '#nested'}],
+                'repository': {'nested': {'match': 'c', 'name': 'c'}},
+            },
+            'unused': {'match': 'x', 'name': 'x'},
+        },
+    })
+
+    with mock.patch.object(Rule, 'make', wraps=Rule.make) as make:
+        grammar = grammars.grammar_for_scope('test')
+        assert make.call_count == 1  # the top level include
+        compiler = grammars.compiler_for_scope('test')
+        _, regions = highlight_line(compiler, compiler.root_state, 'acb', True)
+    assert regions == (
+        Region(0, 1, ('test',)),
+        Region(1, 2, ('test', 'c')),
+        Region(2, 3, ('test',)),
+    )
+    # `used`, its nested pattern and its repository's `nested`
+    assert make.call_count == 4
+    # rules are only made once: the compiler caches them by identity
+    assert grammar.repository['used'] is grammar.repository['used']
+
+
+def test_grammar_repository_nested_shadows_outer(compiler_state):
+    compiler, state = compiler_state({
+        'scopeName': 'test',
+        'patterns': [{'include': '#outer'}, {'include': '#x'}],
+        'repository': {
+            'x': {'match': 'x', 'name': 'outer-x'},
+            'y': {'match': 'y', 'name': 'outer-y'},
+            'outer': {
+                'begin': '<',
+                'end': '>',
+                'patterns': [{'include': '#x'}, {'include': '#y'}],
+                'repository': {'x': {'match': 'x', 'name': 'inner-x'}},
+            },
+        },
+    })
+
+    state, regions = highlight_line(compiler, state, 'x<xy>', True)
+    assert regions == (
+        Region(0, 1, ('test', 'outer-x')),
+        Region(1, 2, ('test',)),
+        Region(2, 3, ('test', 'inner-x')),
+        Region(3, 4, ('test', 'outer-y')),
+        Region(4, 5, ('test',)),
+    )
+
+
+def test_grammar_cache(tmpdir, make_grammars):
+    cache_dir = tmpdir.join('cache')
+    grammar = {'scopeName': 'test', 'patterns': [{'match': 'a', 'name': 'a'}]}
+
+    grammars = make_grammars(grammar, cache_dir=cache_dir)
+    grammars.grammar_for_scope('test')
+    assert cache_dir.join('test.pickle').exists()
+
+    # the second time around the json is not parsed again
+    with mock.patch.object(Grammar, 'make', side_effect=AssertionError):
+        grammars = make_grammars(cache_dir=cache_dir)
+        compiler = grammars.compiler_for_scope('test')
+
+    _, regions = highlight_line(compiler, compiler.root_state, 'a', True)
+    assert regions == (Region(0, 1, ('test', 'a')),)
+
+
+def test_grammar_cache_invalidated_by_modification(tmpdir, make_grammars):
+    cache_dir = tmpdir.join('cache')
+    grammar: dict[str, Any] = {
+        'scopeName': 'test',
+        'patterns': [{'match': 'a', 'name': 'a'}],
+    }
+
+    grammars = make_grammars(grammar, cache_dir=cache_dir)
+    grammars.grammar_for_scope('test')
+
+    grammar['patterns'][0]['name'] = 'changed'
+    grammars = make_grammars(grammar, cache_dir=cache_dir)
+    compiler = grammars.compiler_for_scope('test')
+
+    _, regions = highlight_line(compiler, compiler.root_state, 'a', True)
+    assert regions == (Region(0, 1, ('test', 'changed')),)
+
+
+def test_grammar_cache_invalidated_by_format(tmpdir, make_grammars):
+    cache_dir = tmpdir.join('cache')
+    grammar = {'scopeName': 'test', 'patterns': [{'match': 'a', 'name': 'a'}]}
+
+    grammars = make_grammars(grammar, cache_dir=cache_dir)
+    grammars.grammar_for_scope('test')
+
+    with mock.patch.object(highlight, '_CACHE_FORMAT', -1):
+        with mock.patch.object(Grammar, 'make', wraps=Grammar.make) as make:
+            make_grammars(cache_dir=cache_dir).grammar_for_scope('test')
+    make.assert_called_once()
+
+
+def test_grammar_cache_corrupt(tmpdir, make_grammars):
+    cache_dir = tmpdir.join('cache').ensure_dir()
+    cache_dir.join('test.pickle').write_binary(b'not a pickle')
+    grammar = {'scopeName': 'test', 'patterns': [{'match': 'a', 'name': 'a'}]}
+
+    grammars = make_grammars(grammar, cache_dir=cache_dir)
+    assert grammars.compiler_for_scope('test').root_scope == 'test'
+
+
+def test_grammar_cache_unpicklable(tmpdir, make_grammars):
+    cache_dir = tmpdir.join('cache')
+    grammar = {'scopeName': 'test', 'patterns': [{'match': 'a', 'name': 'a'}]}
+
+    grammars = make_grammars(grammar, cache_dir=cache_dir)
+    with mock.patch.object(pickle, 'dump', side_effect=RecursionError):
+        compiler = grammars.compiler_for_scope('test')
+
+    # the grammar still works, it's just not cached
+    assert compiler.root_scope == 'test'
+    assert cache_dir.listdir() == []
+
+
+def test_file_index_cache(tmpdir, make_grammars):
+    cache_dir = tmpdir.join('cache')
+    grammars = make_grammars(
+        {'scopeName': 'source.a', 'patterns': [], 'fileTypes': ['aext']},
+        {'scopeName': 'source.b', 'patterns': [], 'fileTypes': ['bext']},
+        cache_dir=cache_dir,
+    )
+    compiler = grammars.compiler_for_file('f.aext', '')
+    assert compiler.root_scope == 'source.a'
+    assert cache_dir.join('index.pickle').exists()
+
+    # the index is reused: only the detected grammar is read
+    with mock.patch.object(Grammars, '_make_file_index') as make_index:
+        grammars = make_grammars(cache_dir=cache_dir)
+        compiler = grammars.compiler_for_file('f.bext', '')
+    assert compiler.root_scope == 'source.b'
+    make_index.assert_not_called()
+    assert set(grammars._raw) == {'source.unknown', 'source.b'}
+
+    # adding a grammar invalidates the index
+    grammars = make_grammars(
+        {'scopeName': 'source.c', 'patterns': [], 'fileTypes': ['cext']},
+        cache_dir=cache_dir,
+    )
+    compiler = grammars.compiler_for_file('f.cext', '')
+    assert compiler.root_scope == 'source.c'
+
+
+def test_grammars_shared(tmpdir):
+    grammar_dir = tmpdir.join('grammars').ensure_dir()
+    grammar: dict[str, Any] = {
+        'scopeName': 'test',
+        'patterns': [{'match': 'a', 'name': 'a'}],
+    }
+    grammar_dir.join('test.json').write(json.dumps(grammar))
+
+    grammars = Grammars.shared(str(grammar_dir))
+    compiler = grammars.compiler_for_scope('test')
+    assert Grammars.shared(str(grammar_dir)) is grammars
+    assert Grammars.shared(str(grammar_dir)).compiler_for_scope('test') is (
+        compiler
+    )
+
+    # changing a grammar on disk replaces the shared instance
+    grammar['patterns'][0]['name'] = 'changed'
+    grammar_dir.join('test.json').write(json.dumps(grammar))
+    new_grammars = Grammars.shared(str(grammar_dir))
+    assert new_grammars is not grammars
+    compiler = new_grammars.compiler_for_scope('test')
+    _, regions = highlight_line(compiler, compiler.root_state, 'a', True)
+    assert regions == (Region(0, 1, ('test', 'changed')),)
+
+
 @pytest.fixture
 def compiler_state(make_grammars):
     def _compiler_state(*grammar_dcts):
@@ -41,6 +233,15 @@ def compiler_state(make_grammars):
     return _compiler_state
 
 
+def test_highlight_line_clears_searches(compiler_state):
+    grammar = {'scopeName': 'test', 'patterns': [{'name': 'a', 'match': 'a'}]}
+    compiler, state = compiler_state(grammar)
+
+    highlight_line(compiler, state, 'aba', True)
+    # the shared regexes don't keep the line alive
+    assert reg._searched == []
+
+
 def test_backslash_a(compiler_state):
     grammar = {
         'scopeName': 'test',
@@ -56,6 +257,27 @@ def test_backslash_a(compiler_state):
     assert region_1 == Region(0, 3, ('test',))
 
 
+def test_highlight_lines(compiler_state):
+    grammar = {
+        'scopeName': 'test',
+        'patterns': [{'name': 'aaa', 'match': r'\Aa+'}],
+    }
+    compiler, state = compiler_state(grammar)
+
+    ret = [
+        (state, tuple(regions))
+        for state, regions in highlight_lines(
+            compiler, state, ('aaa', 'aaa'), first_line=True,
+        )
+    ]
+
+    # first_line only applies to the first line of the batch
+    assert ret == [
+        (compiler.root_state, (Region(0, 3, ('test', 'aaa')),)),
+        (compiler.root_state, (Region(0, 3, ('test',)),)),
+    ]
+
+
 BEGIN_END_NO_NL = {
     'scopeName': 'test',
     'patterns': [{
@@ -231,6 +453,35 @@ def test_complex_captures(compiler_state):
     )
 
 
+def test_captures_sub_parse_memoized(compiler_state):
+    compiler, state = compiler_state({
+        'scopeName': 'test',
+        'patterns': [
+            {
+                'match': '<([^>]+)>',
+                'captures': {
+                    '1': {'patterns': [{'match': 'a', 'name': 'a'}]},
+                },
+            },
+        ],
+    })
+
+    state, regions = highlight_line(compiler, state, '<ba> <ba>', True)
+    assert regions == (
+        Region(0, 1, ('test',)),
+        Region(1, 2, ('test',)),
+        Region(2, 3, ('test', 'a')),
+        Region(3, 4, ('test',)),
+        Region(4, 5, ('test',)),
+        Region(5, 6, ('test',)),
+        Region(6, 7, ('test',)),
+        Region(7, 8, ('test', 'a')),
+        Region(8, 9, ('test',)),
+    )
+    # the second `ba` reused the first's regions
+    assert compiler._capture_regions.cache_info().hits == 1
+
+
 def test_captures_multiple_applied_to_same_capture(compiler_state):
     compiler, state = compiler_state({
         'scopeName': 'test',
@@ -274,6 +525,25 @@ def test_captures_multiple_applied_to_same_capture(compiler_state):
     )
 
 
+def test_captures_many_nested(compiler_state):
+    compiler, state = compiler_state({
+        'scopeName': 'test',
+        'patterns': [{
+            'match': f'({"(.)" * 20})',
+            'captures': {
+                '1': {'name': 'outer'},
+                **{str(i): {'name': f'c{i}'} for i in range(2, 22)},
+            },
+        }],
+    })
+
+    state, regions = highlight_line(compiler, state, 'x' * 20, True)
+
+    assert regions == tuple(
+        Region(i, i + 1, ('test', 'outer', f'c{i + 2}')) for i in range(20)
+    )
+
+
 def test_captures_ignores_empty(compiler_state):
     compiler, state = compiler_state({
         'scopeName': 'test',
@@ -332,6 +602,35 @@ def test_captures_begin_end(compiler_state):
     )
 
 
+def test_nested_while_inner_ends(compiler_state):
+    compiler, state = compiler_state({
+        'scopeName': 'test',
+        'patterns': [{
+            'begin': '>',
+            'while': '>',
+            'name': 'quote',
+            'patterns': [{'begin': '-', 'while': '-', 'name': 'item'}],
+        }],
+    })
+
+    state, _ = highlight_line(compiler, state, '>-a\n', True)
+    assert len(state.while_stack) == 2
+    state, regions = highlight_line(compiler, state, '>-b\n', False)
+    assert regions == (
+        Region(0, 1, ('test', 'quote')),
+        Region(1, 2, ('test', 'quote', 'item')),
+        Region(2, 4, ('test', 'quote', 'item')),
+    )
+    # the inner rule stops, the outer one continues
+    state, regions = highlight_line(compiler, state, '>c\n', False)
+    assert regions == (
+        Region(0, 1, ('test', 'quote')),
+        Region(1, 3, ('test', 'quote')),
+    )
+    assert len(state.while_stack) == 1
+    assert state is highlight_line(compiler, state, '>\n', False)[0]
+
+
 def test_captures_while_captures(compiler_state):
     compiler, state = compiler_state({
         'scopeName': 'test',
@@ -674,3 +973,62 @@ def test_buggy_begin_end_grammar(compiler_state):
         Region(5, 6, ('test', 'css')),
         Region(6, 12, ('test',)),
     )
+
+
+def test_states_are_interned(compiler_state):
+    compiler, root = compiler_state(BEGIN_END_NO_NL)
+
+    # distinct (but equal) line strings produce the very same state object
+    state1, _ = highlight_line(compiler, root, 'x\n', False)
+    state2, _ = highlight_line(compiler, root, ''.join(('x', '\n')), False)
+    assert state1 is not root
+    assert state1 is state2
+
+    state3, _ = highlight_line(compiler, state1, 'x\n', False)
+    assert state3 is root
+
+
+def test_state_repr(compiler_state):
+    compiler, state = compiler_state({'scopeName': 'test', 'patterns': []})
+    assert repr(state).startswith("State(entries=(Entry(scope=('test',), ")
+
+
+def test_scope_node_push_is_interned():
+    root = _ScopeNode(('test',))
+    node = root.push(('a', 'b'))
+    assert node == ('test', 'a', 'b')
+    assert hash(node) == hash(('test', 'a', 'b'))
+    assert root.push(('a', 'b')) is node
+    assert root.push(()) is root
+
+
+def test_scope_node_pickles_as_tuple():
+    node = _ScopeNode(('test',)).push(('a',))
+    ret = pickle.loads(pickle.dumps(node))
+    assert type(ret) is tuple
+    assert ret == ('test', 'a')
+
+
+def test_regions_share_scope_nodes(compiler_state):
+    compiler, state = compiler_state({
+        'scopeName': 'test',
+        'patterns': [{'match': 'x', 'name': 'x'}],
+    })
+    _, regions1 = highlight_line(compiler, state, 'x\n', True)
+    _, regions2 = highlight_line(compiler, state, 'y x\n', True)
+    assert regions1[0].scope is regions2[1].scope
+
+
+def test_intern_table_sweeps_dead_references():
+    class C:
+        pass
+
+    table: _InternTable[C] = _InternTable()
+    alive = C()
+    table.add(('alive',), alive)
+    for i in range(2048):
+        table.add((i,), C())
+
+    assert len(table._refs) < 2048
+    assert table.get(('alive',)) is alive
+    assert table.get((2047,)) is None
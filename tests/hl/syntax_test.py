@@ -8,7 +8,9 @@ import pytest
 
 from babi.buf import Buf
 from babi.color_manager import ColorManager
+from babi.hl import syntax as syntax_mod
 from babi.hl.interface import HL
+from babi.hl.syntax import FileSyntax
 from babi.hl.syntax import Syntax
 from babi.theme import Color
 from babi.theme import Theme
@@ -169,3 +171,229 @@ def test_syntax_highlight_cache_first_line(stdscr, make_grammars):
             (HL(0, 3, curses.A_BOLD | 2 << 8),),
             (),
         ]
+
+
+def test_syntax_highlight_until_out_of_time(stdscr, make_grammars):
+    with FakeCurses.patch(n_colors=256, can_change_color=False):
+        grammars = make_grammars({
+            'scopeName': 'source.demo',
+            'fileTypes': ['demo'],
+            'patterns': [{'match': 'int', 'name': 'keyword'}],
+        })
+        syntax = Syntax(grammars, THEME, ColorManager.make())
+        syntax._init_screen(stdscr)
+        file_hl = syntax.file_highlighter('foo.demo', '')
+        lines = Buf(['int', 'int', 'int'])
+        hl = (HL(0, 3, curses.A_BOLD | 2 << 8),)
+
+        # only one line fits in each frame's budget
+        with mock.patch.object(syntax_mod, '_BUDGET', -1):
+            file_hl.highlight_until(lines, 3)
+            assert file_hl.pending
+            assert file_hl.regions == [hl, (), ()]
+
+            file_hl.highlight_until(lines, 3)
+            assert file_hl.pending
+            assert file_hl.regions == [hl, hl, ()]
+
+            file_hl.highlight_until(lines, 3)
+            assert not file_hl.pending
+            assert file_hl.regions == [hl, hl, hl]
+
+
+def test_syntax_attr_resolved_once_per_scope(stdscr, make_grammars):
+    with FakeCurses.patch(n_colors=256, can_change_color=False):
+        grammars = make_grammars({
+            'scopeName': 'source.demo',
+            'fileTypes': ['demo'],
+            'patterns': [
+                {'match': 'int', 'name': 'keyword'},
+                {'match': '"[^"]*"', 'name': 'string'},
+            ],
+        })
+        syntax = Syntax(grammars, THEME, ColorManager.make())
+        syntax._init_screen(stdscr)
+        with mock.patch.object(
+                FileSyntax, '_attr_uncached', autospec=True,
+                side_effect=FileSyntax._attr_uncached,
+        ) as attr_uncached:
+            file_hl = syntax.file_highlighter('foo.demo', '')
+            lines = Buf(['int "s" x', 'int x', '"t" int'])
+            file_hl.highlight_until(lines, 3)
+
+    keyword = HL(0, 3, curses.A_BOLD | 2 << 8)
+    assert file_hl.regions == [
+        (keyword, HL(4, 7, 3 << 8)),
+        (keyword,),
+        (HL(0, 3, 3 << 8), HL(4, 7, curses.A_BOLD | 2 << 8)),
+    ]
+    # source.demo, keyword, string
+    assert attr_uncached.call_count == 3
+
+
+def test_syntax_set_theme_restyles_visible_lines(stdscr, make_grammars):
+    with FakeCurses.patch(n_colors=256, can_change_color=False):
+        grammars = make_grammars({
+            'scopeName': 'source.demo',
+            'fileTypes': ['demo'],
+            'patterns': [{'match': 'int', 'name': 'keyword'}],
+        })
+        syntax = Syntax(grammars, THEME, ColorManager.make())
+        syntax._init_screen(stdscr)
+        file_hl = syntax.file_highlighter('foo.demo', '')
+        assert isinstance(file_hl, FileSyntax)
+        lines = Buf(['int', 'int', 'int', 'int'])
+        file_hl.register_callbacks(lines)
+        file_hl.highlight_until(lines, 4)
+        states = list(file_hl._states)
+
+        new_theme = Theme.from_dct({
+            'tokenColors': [
+                {'scope': 'keyword', 'settings': {'fontStyle': 'italic'}},
+            ],
+        })
+        file_hl.set_theme(new_theme, syntax.color_manager)
+
+        old = (HL(0, 3, curses.A_BOLD | 2 << 8),)
+        new = (HL(0, 3, curses.A_ITALIC | 3 << 8),)
+        # only the lines on screen are restyled
+        lines.file_y = 1
+        file_hl.highlight_until(lines, 3)
+        assert file_hl.regions == [old, new, new, old]
+        assert file_hl._states == states
+
+        # an edit drops the lines after it, those are tokenized again
+        lines[2] = 'int'
+        lines.file_y = 0
+        file_hl.highlight_until(lines, 4)
+        assert file_hl.regions == [new, new, new, new]
+
+
+@pytest.fixture
+def tokenizer_syntax(stdscr, tokenizer_worker):
+    grammars, tokenizer, start_worker = tokenizer_worker
+    with FakeCurses.patch(n_colors=256, can_change_color=False):
+        syntax = Syntax(grammars, THEME, ColorManager.make(), tokenizer)
+        syntax._init_screen(stdscr)
+        # the worker is started by the test
+        yield syntax, start_worker
+
+
+def test_tokenizer_file_syntax(tokenizer_syntax):
+    syntax, start_worker = tokenizer_syntax
+    lines = Buf(['int "s', 'x" int', '"t"', 'int'])
+
+    local_hl = syntax._replace(tokenizer=None).file_highlighter('f.demo', '')
+    local_hl.highlight_until(lines, 4)
+
+    start_worker()
+    file_hl = syntax.file_highlighter('f.demo', '')
+    assert file_hl.root_scope == 'source.demo'
+    with mock.patch.object(syntax_mod, '_BATCH', 3):
+        file_hl.highlight_until(lines, 4)
+
+    assert not file_hl.pending
+    assert file_hl.regions == local_hl.regions
+
+    blank_hl = syntax.blank_file_highlighter()
+    assert blank_hl.root_scope == 'source.unknown'
+    blank_hl.highlight_until(lines, 4)
+    assert blank_hl.regions == [(), (), (), ()]
+
+
+def test_tokenizer_file_syntax_edit_while_tokenizing(tokenizer_syntax):
+    syntax, start_worker = tokenizer_syntax
+    lines = Buf(['int', 'int'])
+    keyword = (HL(0, 3, curses.A_BOLD | 2 << 8),)
+    string = (HL(0, 3, 3 << 8),)
+
+    file_hl = syntax.file_highlighter('f.demo', '')
+    file_hl.register_callbacks(lines)
+
+    # nothing is serving the pipe yet
+    with mock.patch.object(syntax_mod, '_BUDGET', -1):
+        file_hl.highlight_until(lines, 2)
+    assert file_hl.pending
+    assert file_hl.regions == [(), ()]
+
+    # the batch in flight is out of date by the time it arrives
+    lines[0] = '"x"'
+    start_worker()
+    file_hl.highlight_until(lines, 2)
+    assert not file_hl.pending
+    assert file_hl.regions == [string, keyword]
+
+    # lines after what was sent don't throw anything away
+    lines.append('int')
+    file_hl.highlight_until(lines, 3)
+    assert file_hl.regions == [string, keyword, keyword]
+
+    del lines[0]
+    file_hl.highlight_until(lines, 2)
+    assert file_hl.regions == [keyword, keyword]
+
+
+def test_tokenizer_file_syntax_other_file_in_flight(tokenizer_syntax):
+    syntax, start_worker = tokenizer_syntax
+    lines = Buf(['int'])
+    file_hl1 = syntax.file_highlighter('f.demo', '')
+    file_hl2 = syntax.file_highlighter('g.demo', '')
+
+    # nothing is serving the pipe yet
+    with mock.patch.object(syntax_mod, '_BUDGET', -1):
+        file_hl1.highlight_until(lines, 1)
+        # the draw isn't held up waiting on the other file's batch
+        file_hl2.highlight_until(lines, 1)
+    assert file_hl2.pending
+    assert file_hl2.regions == [()]
+
+    start_worker()
+    file_hl2.highlight_until(lines, 1)
+    assert not file_hl2.pending
+    assert file_hl2.regions == [(HL(0, 3, curses.A_BOLD | 2 << 8),)]
+
+
+def test_tokenizer_file_syntax_worker_died(tokenizer_syntax):
+    syntax, start_worker = tokenizer_syntax
+    start_worker()
+    file_hl = syntax.file_highlighter('f.demo', '')
+    assert not file_hl.failed
+
+    assert syntax.tokenizer is not None
+    syntax.tokenizer.dead = True
+    assert file_hl.failed
+    # highlighted in process from now on
+    assert isinstance(syntax.file_highlighter('f.demo', ''), FileSyntax)
+
+
+def test_tokenizer_file_syntax_set_theme(tokenizer_syntax):
+    syntax, start_worker = tokenizer_syntax
+    lines = Buf(['int', 'int', 'int'])
+    file_hl = syntax.file_highlighter('f.demo', '')
+    file_hl.register_callbacks(lines)
+
+    start_worker()
+    file_hl.highlight_until(lines, 3)
+
+    new_theme = Theme.from_dct({
+        'tokenColors': [
+            {'scope': 'keyword', 'settings': {'fontStyle': 'italic'}},
+        ],
+    })
+    file_hl.set_theme(new_theme, syntax.color_manager)
+    lines.file_y = 1
+    file_hl.highlight_until(lines, 2)
+
+    old = (HL(0, 3, curses.A_BOLD | 2 << 8),)
+    new = (HL(0, 3, curses.A_ITALIC | 3 << 8),)
+    # only the lines on screen are restyled, without tokenizing again
+    assert file_hl.regions == [old, new, old]
+    file_hl.highlight_until(lines, 3)
+    assert file_hl.regions == [old, new, new]
+
+    file_hl.set_highlight_limit(1)
+    lines.file_y = 0
+    file_hl.highlight_until(lines, 3)
+    # lines which aren't highlighted are dimmed
+    skipped = (HL(0, 3, curses.A_DIM | 3 << 8),)
+    assert file_hl.regions == [skipped, skipped, skipped]
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import pytest
+
+from babi.prefilter import first_chars
+from babi.prefilter import make_prefilter
+
+
+@pytest.mark.parametrize(
+    ('s', 'expected'),
+    (
+        pytest.param('abc', 'a', id='literal'),
+        pytest.param(r'\bfoo|bar', 'bf', id='alternatives'),
+        pytest.param(r'\\', '\\', id='escaped'),
+        pytest.param(r'\t|\h', '\t0123456789ABCDEFabcdef', id='escapes'),
+        pytest.param('{', '{', id='brace is a literal'),
+        pytest.param('a{2}', 'a', id='quantifier'),
+        pytest.param('a{0,2}b', 'ab', id='optional quantifier'),
+        pytest.param('a*?b|c??d', 'abcd', id='lazy'),
+        pytest.param('(a|)b', 'ab', id='empty alternative'),
+        pytest.param('(?:a)(?>b)(?<c>c)', 'a', id='groups'),
+        pytest.param('(?<c>[a])|((b))', 'ab', id='nested groups'),
+        pytest.param('(?-mix:abc)', 'a', id='options off'),
+        pytest.param(r'(?<!\w)(?=x)(?#comment)x', 'x', id='lookaround'),
+        pytest.param(r'\Aa|\Gb|$c', 'abc', id='anchors'),
+        pytest.param('(?x) \\b (lambda) # comment\n', 'l', id='extended'),
+        pytest.param(r'(?x) [ ] b', ' ', id='extended class'),
+        pytest.param(r'[0-3a]', '0123a', id='class'),
+        pytest.param(r'[a\-z]', '-az', id='escaped dash'),
+        pytest.param(r'[-a]', '-a', id='leading dash'),
+        pytest.param(r'[\]]|[\s&&]', None, id='class intersection'),
+        pytest.param('[]a]', None, id='leading bracket'),
+        pytest.param(r'[\.-a]', None, id='escaped range'),
+        pytest.param('[a-c-e]', None, id='range of range'),
+        pytest.param(r'[\x00-\x1f]', None, id='class hex escape'),
+        pytest.param('[[:alpha:]]', None, id='posix class'),
+        pytest.param('[^a]', None, id='negated class'),
+        pytest.param('[^]a]', None, id='negated leading bracket'),
+        pytest.param('[\u0000-\uffff]', None, id='huge range'),
+        pytest.param('[a', None, id='unclosed class'),
+        pytest.param('(a', None, id='unclosed group'),
+        pytest.param('([a)', None, id='unclosed class in group'),
+        pytest.param('(?x)[a', None, id='extended unclosed class'),
+        pytest.param('(?x)(?-x:a b)', None, id='extended turned off'),
+        pytest.param('(?i)a', None, id='case insensitive'),
+        pytest.param('(?i:a)', None, id='case insensitive group'),
+        pytest.param(r'\w', None, id='word'),
+        pytest.param(r'\ ', None, id='escaped space'),
+        pytest.param('.', None, id='any'),
+        pytest.param('a?', None, id='empty match'),
+        pytest.param('(a|)', None, id='empty group'),
+        pytest.param('', None, id='empty'),
+        pytest.param('a|*', None, id='bad quantifier'),
+        pytest.param('a|{2}', None, id='bad interval'),
+        pytest.param('\\', None, id='trailing backslash'),
+    ),
+)
+def test_first_chars(s, expected):
+    ret = first_chars(s)
+    assert (None if ret is None else ''.join(sorted(ret))) == expected
+
+
+def test_first_chars_unicode_spaces():
+    ret = first_chars(r'\s*#')
+    assert ret is not None
+    assert {'#', ' ', '\t', '\n', '\xa0', '\u3000'} <= ret
+
+
+def test_make_prefilter():
+    prefilter = make_prefilter(('a', 'b+'))
+    assert prefilter is not None
+    match = prefilter.search('xxbxa', 1)
+    assert match is not None and match.start() == 2
+
+    assert make_prefilter(('a', r'\w')) is None
+    assert make_prefilter(('a', r'\Gb')) is None
+
+    prefilter = make_prefilter(())
+    assert prefilter is not None and prefilter.search('abc') is None
@@ -1,10 +1,18 @@
 from __future__ import annotations
 
+from unittest import mock
+
 import onigurumacffi
 import pytest
 
+from babi.reg import _LRURegs
 from babi.reg import _Reg
 from babi.reg import _RegSet
+from babi.reg import cache_stats
+from babi.reg import CacheStats
+from babi.reg import clear_searches
+from babi.reg import make_backref_reg
+from babi.reg import make_reg
 
 
 def test_reg_first_line():
@@ -47,6 +55,95 @@ def test_reg_repr():
     assert repr(_Reg(r'\A123')) == r"_Reg('\\A123')"
 
 
+def _spy_search(reg, attr):
+    return mock.patch.object(reg, attr, mock.Mock(wraps=getattr(reg, attr)))
+
+
+def test_reg_search_reuses_result_for_later_pos():
+    # (case insensitive so the prefilter doesn't skip any searches)
+    reg = _Reg('(?i)b')
+    line = 'aaab'
+    with _spy_search(reg, '_reg') as spy:
+        assert reg.search(line, 0, first_line=False, boundary=False)
+        assert reg.search(line, 2, first_line=False, boundary=False)
+        assert reg.search(line, 3, first_line=False, boundary=False)
+        assert spy.search.call_count == 1
+        # an earlier position, other flags, or another line all re-search
+        assert reg.search(line, 1, first_line=False, boundary=False)
+        assert reg.search(line, 1, first_line=True, boundary=False)
+        assert reg.search(f'{line} ', 1, first_line=True, boundary=False)
+        assert spy.search.call_count == 3
+        # past the previous match
+        assert not reg.search(line, 4, first_line=False, boundary=False)
+        assert not reg.search(line, 4, first_line=False, boundary=False)
+        assert spy.search.call_count == 4
+
+
+def test_reg_search_not_reused_for_boundary_anchor():
+    reg = _Reg(r'\Gb|c')
+    line = 'bbbc'
+    with _spy_search(reg, '_reg') as spy:
+        match = reg.search(line, 0, first_line=False, boundary=False)
+        assert match is not None and match.start == 3
+        match = reg.search(line, 1, first_line=False, boundary=True)
+        assert match is not None and match.start == 1
+        match = reg.search(line, 2, first_line=False, boundary=True)
+        assert match is not None and match.start == 2
+        assert spy.search.call_count == 3
+
+
+def test_clear_searches():
+    reg, regset = _Reg('(?i)b'), _RegSet('c')
+    line = 'aaab'
+    reg.search(line, 0, first_line=False, boundary=False)
+    regset.search(line, 0, first_line=False, boundary=False)
+
+    clear_searches()
+    # the line is no longer kept alive by the shared regexes
+    assert line not in reg._last
+    assert line not in regset._last
+    with _spy_search(reg, '_reg') as spy:
+        assert reg.search(line, 0, first_line=False, boundary=False)
+        assert spy.search.call_count == 1
+
+
+def test_reg_match_str_offsets():
+    line = 'héllo wörld'
+    match = _Reg(r'w(ö)(x)?rld').search(line, 0, False, False)
+    assert match is not None
+    assert match.string is line
+    assert (match.start, match.end) == (6, 11)
+    assert match.span(1) == (7, 8)
+    assert match[0] == 'wörld'
+    assert match[1] == 'ö'
+    assert match[2] == ''  # unmatched group
+    assert repr(match) == "<Match span=(6, 11) match='wörld'>"
+
+
+def test_reg_search_prefilter():
+    reg = _Reg(r'\*/')
+    with _spy_search(reg, '_reg') as spy:
+        # no `*` anywhere: oniguruma isn't needed to know it can't match
+        assert not reg.search('/* comment', 2, False, False)
+        assert spy.search.call_count == 0
+
+        match = reg.search('a * b */', 0, False, False)
+        assert match is not None and match.start == 6
+        # the search starts at the first `*`
+        assert spy.search.call_args[0][1] == 2
+
+
+def test_regset_search_prefilter():
+    regset = _RegSet('"', r'\\.')
+    with _spy_search(regset, '_set') as spy:
+        assert regset.search('no quotes', 0, False, False) == (-1, None)
+        assert spy.search.call_count == 0
+
+        idx, match = regset.search('a \\n "', 0, False, False)
+        assert idx == 1 and match is not None and match.start == 2
+        assert spy.search.call_count == 1
+
+
 def test_regset_first_line():
     regset = _RegSet(r'\Ahello', 'hello')
     idx, _ = regset.search('hello', 0, first_line=True, boundary=True)
@@ -71,5 +168,70 @@ def test_regset_neither():
     assert idx == 2
 
 
+def test_regset_search_reuses_result_for_later_pos():
+    regset = _RegSet('c', r'\Gb')
+    line = 'bbc'
+    with _spy_search(regset, '_set') as spy:
+        assert regset.search(line, 0, first_line=False, boundary=False)[0] == 0
+        assert regset.search(line, 1, first_line=False, boundary=False)[0] == 0
+        assert spy.search.call_count == 1
+        assert regset.search(line, 1, first_line=False, boundary=True)[0] == 1
+        assert regset.search(line, 1, first_line=False, boundary=True)[0] == 1
+        assert spy.search.call_count == 3
+
+
+def test_regset_compiled_on_first_search():
+    regset = _RegSet('a', 'b')
+    assert '_set' not in vars(regset)
+    idx, _ = regset.search('b', 0, first_line=False, boundary=False)
+    assert idx == 1
+    assert '_set' in vars(regset)
+
+
 def test_regset_repr():
     assert repr(_RegSet('ohai', r'\Aworld')) == r"_RegSet('ohai', '\\Aworld')"
+
+
+def test_make_backref_reg_without_backrefs_is_static():
+    match = _Reg('(a)').search('a', 0, first_line=False, boundary=False)
+    assert match is not None
+    assert make_backref_reg(match, 'b') is make_reg('b')
+
+
+def test_make_backref_reg_expands_backrefs():
+    begin = _Reg('<<(\\w+)')
+    match = begin.search('<<EOF', 0, first_line=False, boundary=False)
+    assert match is not None
+    reg = make_backref_reg(match, '^\\1$')
+    assert reg is make_backref_reg(match, '^\\1$')
+    assert reg is not make_reg('^EOF$')
+    assert reg.search('EOF', 0, first_line=False, boundary=False)
+    assert not reg.search('EOL', 0, first_line=False, boundary=False)
+
+
+def test_backref_regs_are_bounded():
+    before = cache_stats()['backref_reg']
+    reg = _Reg('(.+)')
+    for i in range(300):
+        match = reg.search(f'd{i}', 0, first_line=False, boundary=False)
+        assert match is not None
+        make_backref_reg(match, '\\1')
+    after = cache_stats()['backref_reg']
+    assert after.compiles >= before.compiles + 300
+    assert after.evictions > before.evictions
+    assert after.size == 256
+
+
+def test_lru_regs_counts_evictions():
+    regs = _LRURegs(maxsize=2)
+    a = regs('a')
+    regs('b')
+    assert regs('a') is a
+    regs('c')  # evicts b
+    regs('b')  # compiled again, evicts a
+    assert regs.stats() == CacheStats(
+        hits=1, compiles=4, evictions=2, size=2,
+    )
+
+    regs.cache_clear()
+    assert regs.stats() == CacheStats(hits=0, compiles=0, evictions=0, size=0)
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
 import json
+from unittest import mock
 
 import pytest
 
+from babi import textmate_demo
+from babi.highlight import Region
 from babi.textmate_demo import main
 
 THEME = {
@@ -84,3 +87,135 @@ def test_basic_with_blank_theme(theme_grammars, tmpdir, capsys):
     out, _ = capsys.readouterr()
 
     assert out == '*bold*/italic/_underline_# comment\n\x1b[m'
+
+
+MULTILINE_GRAMMAR = {
+    'scopeName': 'source.demo',
+    'fileTypes': ['demo'],
+    'patterns': [
+        {'begin': '<<', 'end': '>>', 'name': 'comment'},
+        {'match': r'\A#.*', 'name': 'bold'},
+        {'match': r'\*[^*]*\*', 'name': 'bold'},
+    ],
+}
+MULTILINE_SRC = '''\
+# first line
+a *b* c
+<< d
+e *f*
+g >> *h*
+<< i >>
+j
+<<
+k >>
+'''
+
+
+@pytest.mark.parametrize('jobs', ('2', '3'))
+def test_parallel_matches_sequential(theme_grammars, tmpdir, capsys, jobs):
+    theme, grammars = theme_grammars
+    grammars.join('source.demo.json').write(json.dumps(MULTILINE_GRAMMAR))
+
+    f = tmpdir.join('f.demo')
+    f.write(MULTILINE_SRC)
+
+    args = ('--theme', str(theme), '--grammar-dir', str(grammars), str(f))
+
+    assert not main(args)
+    expected, _ = capsys.readouterr()
+
+    assert not main(('--jobs', jobs, *args))
+    out, _ = capsys.readouterr()
+
+    assert out == expected
+
+
+def test_highlight_chunk(theme_grammars, tmpdir):
+    # the worker functions run in subprocesses, exercise them directly here
+    _, grammars = theme_grammars
+    grammars.join('source.demo.json').write(json.dumps(MULTILINE_GRAMMAR))
+    f = tmpdir.join('f.demo')
+
+    with mock.patch.object(textmate_demo, '_worker_compiler', None):
+        textmate_demo._init_worker(str(grammars), str(f), '')
+        ret = textmate_demo._highlight_chunk((['a\n', '<<\n', '>>\n'], True))
+
+    src = ('source.demo',)
+    comment = ('source.demo', 'comment')
+    assert ret == [
+        ((Region(0, 2, src),), True),
+        ((Region(0, 2, comment), Region(2, 3, comment)), False),
+        ((Region(0, 2, comment), Region(2, 3, src)), True),
+    ]
+
+
+PROFILE_GRAMMAR = {
+    'scopeName': 'source.demo',
+    'fileTypes': ['demo'],
+    'patterns': [
+        {'begin': '<<', 'end': '>>'},
+        {'begin': '>', 'while': '>'},
+        {'match': r'\*[^*]*\*', 'name': 'bold'},
+        {'match': '!'},
+        {
+            'match': r'\[(.*)\]', 'name': 'group',
+            'captures': {'1': {'patterns': [{'include': '$self'}]}},
+        },
+    ],
+}
+
+
+def test_profile(theme_grammars, tmpdir, capsys):
+    theme, grammars = theme_grammars
+    grammars.join('source.demo.json').write(json.dumps(PROFILE_GRAMMAR))
+
+    f = tmpdir.join('f.demo')
+    f.write('<< a >> !\n> quote\n> b\n*c* [[d]]\n')
+
+    args = ('--theme', str(theme), '--grammar-dir', str(grammars), str(f))
+
+    assert not main(args)
+    expected, _ = capsys.readouterr()
+
+    search_before = textmate_demo._RegSet.search
+    assert not main(('--profile', *args))
+    out, err = capsys.readouterr()
+
+    assert out == expected
+    # the wrappers are removed afterwards
+    assert textmate_demo._RegSet.search is search_before
+
+    header, *lines = err.splitlines()
+    assert header.split() == ['ms', 'calls', 'found', 'what']
+    whats = {' '.join(line.split()[3:5]) for line in lines if line}
+    assert {
+        "EndRule.start end='>>'",
+        "EndRule.search end='>>'",
+        "WhileRule.continues while='>'",
+        'MatchRule.start bold',
+        'MatchRule.start (unnamed)',
+        'MatchRule.start group',
+        'PatternRule.search source.demo',
+    } <= whats
+    assert any(line.startswith('regset cache: ') for line in lines)
+
+
+def test_profile_report_truncates_long_names():
+    profiler = textmate_demo._Profiler()
+    profiler.stats['_RegSet.search', f'_RegSet({"x" * 200!r})'].calls = 1
+
+    _, line, *_ = profiler.report().splitlines()
+    what = line.split(None, 3)[3]
+    assert what == f'_RegSet.search _RegSet(\'{"x" * 88}...'
+
+
+def test_profile_wrapped_call_raises():
+    profiler = textmate_demo._Profiler()
+    wrapped = profiler._wrap(
+        mock.Mock(side_effect=ValueError), 'f', str, None,
+    )
+    with pytest.raises(ValueError):
+        wrapped('obj')
+
+    # otherwise the later calls would be taken to be nested in it
+    assert profiler._active['f', 'obj'] == 0
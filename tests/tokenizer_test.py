@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import multiprocessing
+from multiprocessing.context import SpawnProcess
+from unittest import mock
+
+import pytest
+
+from babi.highlight import Region
+from babi.tokenizer import _Batch
+from babi.tokenizer import Tokenized
+from babi.tokenizer import Tokenizer
+from babi.tokenizer import tokenizer_process
+
+
+@pytest.fixture
+def tokenizer(tokenizer_worker):
+    _, tokenizer, start_worker = tokenizer_worker
+    start_worker()
+    return tokenizer
+
+
+def _send(tokenizer, doc, start, *lines, highlight_limit=100, timeout=5):
+    return tokenizer.send(
+        doc, 0, 'f.demo', '', start, lines,
+        highlight_limit=highlight_limit, timeout=timeout,
+    )
+
+
+def _regions(tokenizer, tokenized):
+    assert tokenized is not None
+    return [
+        tuple(Region(start, end, tokenizer.scopes[n]) for start, end, n in t)
+        for t in tokenized.tokens
+    ]
+
+
+def test_tokenizer_tokenizes_a_batch(tokenizer):
+    doc = tokenizer.new_doc()
+    _send(tokenizer, doc, 0, 'int x')
+    assert tokenizer.result(doc, timeout=5) == Tokenized(
+        doc=doc, generation=0, start=0, tokens=[((0, 3, 0), (3, 6, 1))],
+    )
+    assert tokenizer.scopes == [('source.demo', 'keyword'), ('source.demo',)]
+
+
+def test_tokenizer_numbers_each_scope_once(tokenizer):
+    doc = tokenizer.new_doc()
+    _send(tokenizer, doc, 0, 'int x')
+    tokenizer.result(doc, timeout=5)
+    _send(tokenizer, doc, 1, '"s" int', 'int x')
+
+    ret = tokenizer.result(doc, timeout=5)
+    assert _regions(tokenizer, ret) == [
+        (
+            Region(0, 1, ('source.demo', 'string')),
+            Region(1, 2, ('source.demo', 'string')),
+            Region(2, 3, ('source.demo', 'string')),
+            Region(3, 4, ('source.demo',)),
+            Region(4, 7, ('source.demo', 'keyword')),
+            Region(7, 8, ('source.demo',)),
+        ),
+        (
+            Region(0, 3, ('source.demo', 'keyword')),
+            Region(3, 6, ('source.demo',)),
+        ),
+    ]
+    # only the string is new
+    assert len(tokenizer.scopes) == 3
+
+
+def test_tokenizer_continues_from_the_previous_batch(tokenizer):
+    doc = tokenizer.new_doc()
+    _send(tokenizer, doc, 0, '"hello')
+    tokenizer.result(doc, timeout=5)
+
+    _send(tokenizer, doc, 1, 'world" int')
+    regions, = _regions(tokenizer, tokenizer.result(doc, timeout=5))
+    assert regions[0] == Region(0, 5, ('source.demo', 'string'))
+
+    # lines after the start are from an older version and are thrown away
+    _send(tokenizer, doc, 0, 'world" int')
+    regions, = _regions(tokenizer, tokenizer.result(doc, timeout=5))
+    assert regions[0] == Region(0, 5, ('source.demo',))
+
+
+def test_tokenizer_skips_long_lines(tokenizer):
+    doc = tokenizer.new_doc()
+    _send(tokenizer, doc, 0, '"long line', 'int', highlight_limit=5)
+    regions = _regions(tokenizer, tokenizer.result(doc, timeout=5))
+    # the long line does not start a string either
+    assert regions[0] == ()
+    assert regions[1][0] == Region(0, 3, ('source.demo', 'keyword'))
+
+
+def test_tokenizer_result_nothing_sent(tokenizer):
+    assert tokenizer.result(tokenizer.new_doc(), timeout=0) is None
+
+
+def test_tokenizer_keeps_results_for_other_files(tokenizer):
+    doc1 = tokenizer.new_doc()
+    doc2 = tokenizer.new_doc()
+    _send(tokenizer, doc1, 0, 'int')
+    # the first batch is received before another is sent
+    _send(tokenizer, doc2, 0, 'x')
+
+    ret2 = tokenizer.result(doc2, timeout=5)
+    assert ret2 is not None and ret2.doc == doc2
+    ret1 = tokenizer.result(doc1, timeout=0)
+    assert ret1 is not None and ret1.doc == doc1
+
+
+def test_tokenizer_forget(tokenizer):
+    doc1 = tokenizer.new_doc()
+    doc2 = tokenizer.new_doc()
+    _send(tokenizer, doc1, 0, 'int')
+    tokenizer.forget(doc1)
+    _send(tokenizer, doc2, 0, 'x')
+
+    assert tokenizer.result(doc2, timeout=5) is not None
+    assert tokenizer.result(doc1, timeout=0) is None
+
+
+def test_tokenizer_send_does_not_wait_past_timeout():
+    conn, worker_conn = multiprocessing.Pipe()
+    tokenizer = Tokenizer(conn)
+    doc1 = tokenizer.new_doc()
+    doc2 = tokenizer.new_doc()
+    assert _send(tokenizer, doc1, 0, 'int')
+    # the first batch isn't done yet
+    assert not _send(tokenizer, doc2, 0, 'x', timeout=0)
+
+    worker_conn.recv()
+    worker_conn.send(_Batch([], [()]))
+    assert _send(tokenizer, doc2, 0, 'x', timeout=5)
+    assert tokenizer.result(doc1, timeout=0) is not None
+
+
+def test_tokenizer_dead_while_waiting():
+    conn, worker_conn = multiprocessing.Pipe()
+    tokenizer = Tokenizer(conn)
+    doc = tokenizer.new_doc()
+    assert _send(tokenizer, doc, 0, 'int')
+    worker_conn.close()
+
+    assert tokenizer.result(doc, timeout=5) is None
+    assert tokenizer.dead
+    assert not _send(tokenizer, doc, 0, 'int')
+
+
+def test_tokenizer_dead_when_sending():
+    conn, worker_conn = multiprocessing.Pipe()
+    tokenizer = Tokenizer(conn)
+    worker_conn.close()
+
+    assert not _send(tokenizer, tokenizer.new_doc(), 0, 'int')
+    assert tokenizer.dead
+
+
+def test_tokenizer_process(tmpdir):
+    tmpdir.join('demo.json').write(
+        '{"scopeName": "source.demo", "fileTypes": ["demo"], '
+        '"patterns": [{"match": "int", "name": "keyword"}]}',
+    )
+    with tokenizer_process(str(tmpdir)) as tokenizer:
+        doc = tokenizer.new_doc()
+        _send(tokenizer, doc, 0, 'int')
+        ret = tokenizer.result(doc, timeout=30)
+    assert _regions(tokenizer, ret) == [
+        (
+            Region(0, 3, ('source.demo', 'keyword')),
+            Region(3, 4, ('source.demo',)),
+        ),
+    ]
+
+
+def test_tokenizer_process_terminated_if_it_does_not_exit(tmpdir):
+    terminate_mock = mock.patch.object(
+        SpawnProcess, 'terminate', autospec=True,
+        side_effect=SpawnProcess.terminate,
+    )
+    with mock.patch.object(SpawnProcess, 'is_alive', return_value=True):
+        with terminate_mock as terminate:
+            with tokenizer_process(str(tmpdir)):
+                pass
+    terminate.assert_called_once()